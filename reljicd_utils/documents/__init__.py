@@ -1,3 +1,5 @@
 from reljicd_utils.documents.csv_processor import *
 from reljicd_utils.documents.excel import *
+from reljicd_utils.documents.parquet import *
+from reljicd_utils.documents.record_schema import *
 # from .xml import *
@@ -1,25 +1,81 @@
-from typing import Dict, Generator
+import os
+from typing import Dict, Generator, List, Optional, Union
 
-import numpy
 import pandas
-from pandas import notnull
+from pandas import DataFrame
+
+from reljicd_utils.documents.record_schema import RecordSchema, python_objects
+from reljicd_utils.utils.s3 import is_s3_path, open_source
+
+_COMPRESSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.zip': 'zip', '.xz': 'xz',
+                 '.zst': 'zstd'}
 
 
 def csv_dict_generator(
         file: str,
         separator: str = ",",
         encoding: str = "utf-8",
-        error_bad_lines: bool = True) -> Generator[Dict, None, None]:
-    df = pandas.read_csv(file, sep=separator, encoding=encoding,
-                         error_bad_lines=error_bad_lines)
-    df = df.where((notnull(df)),
-                  None)  # Fix for converting NaN in dataframe to None
-
-    for original_record in df.to_dict('records'):
-        record = {}
-        for key, value in original_record.items():
-            if isinstance(value, numpy.int64):  # Fix for psycopg
-                value = int(value)
-            record[key] = value
-
-        yield record
+        error_bad_lines: bool = True,
+        chunksize: int = None,
+        schema: RecordSchema = None) -> Generator[Dict, None, None]:
+    for df in _csv_chunks(file, separator=separator, encoding=encoding,
+                          error_bad_lines=error_bad_lines,
+                          chunksize=chunksize):
+        if schema:
+            yield from schema.records(df)
+        else:
+            yield from python_objects(df).to_dict('records')
+
+
+def csv_batch_generator(
+        file: str,
+        separator: str = ",",
+        encoding: str = "utf-8",
+        error_bad_lines: bool = True,
+        chunksize: int = 10000,
+        orient: str = 'records',
+        schema: RecordSchema = None) -> Generator[Union[List[Dict],
+                                                    Dict[str, List]],
+                                              None, None]:
+    """Yield ``chunksize`` rows at a time, e.g. for ``BaseModel.bulk_insert``.
+
+    ``orient='records'`` yields lists of dicts, ``orient='columns'`` yields
+    one dict of column lists per chunk.
+    """
+    if orient not in ('records', 'columns'):
+        raise ValueError(f'Unknown orient: {orient}')
+
+    for df in _csv_chunks(file, separator=separator, encoding=encoding,
+                          error_bad_lines=error_bad_lines,
+                          chunksize=chunksize):
+        if orient == 'columns':
+            df = schema.apply(df) if schema else python_objects(df)
+            yield {column: df[column].tolist() for column in df.columns}
+        elif schema:
+            yield schema.records(df)
+        else:
+            yield python_objects(df).to_dict('records')
+
+
+def _csv_chunks(file: str,
+                separator: str,
+                encoding: str,
+                error_bad_lines: bool,
+                chunksize: int = None) -> Generator[DataFrame, None, None]:
+    with open_source(file) as source:
+        options = dict(sep=separator, encoding=encoding,
+                       error_bad_lines=error_bad_lines,
+                       compression=_compression(file))
+        if chunksize:
+            with pandas.read_csv(source, chunksize=chunksize,
+                                 **options) as reader:
+                yield from reader
+        else:
+            yield pandas.read_csv(source, **options)
+
+
+def _compression(file: str) -> Optional[str]:
+    # Pandas only infers it from a path, S3 objects are file objects
+    if not is_s3_path(file):
+        return 'infer'
+    return _COMPRESSIONS.get(os.path.splitext(file)[1].lower())
@@ -1,19 +1,73 @@
-from typing import Generator
+from collections import namedtuple
+from typing import BinaryIO, Generator, Iterable, Tuple, Union
 
 import pandas
+from openpyxl import load_workbook
 from pandas import notnull
 
+from reljicd_utils.collections.iter_counter import iter_counter
+from reljicd_utils.utils.s3 import open_source
+
 
 def excel_itertuple_generator(file: str,
-                              print_progress: bool = False) -> Generator:
-    df = pandas.read_excel(file)
-    df = df.where((notnull(df)),
-                  None)  # Fix for converting NaN in dataframe to None
+                              print_progress: bool = False,
+                              stream: bool = False,
+                              sheet_name: Union[str, int] = 0,
+                              print_step: int = 1000) -> Generator:
+    """Yield the rows of a sheet as ``Pandas`` namedtuples.
+
+    With ``stream`` the workbook is read row by row in read-only mode, so
+    memory does not grow with the number of rows; values are the raw cell
+    values instead of pandas inferred column types.
+    """
+    # xlsx files are zip archives, so S3 objects are spooled to disk
+    with open_source(file, seekable=True) as f:
+        if stream:
+            total, itertuples = _streamed_itertuples(f, sheet_name)
+        else:
+            df = pandas.read_excel(f, sheet_name=sheet_name)
+            df = df.where((notnull(df)),
+                          None)  # Fix for converting NaN in dataframe to None
+            total, itertuples = df.shape[0], df.itertuples()
+
+        if print_progress:
+            itertuples = iter_counter(iterable=itertuples,
+                                      total=total,
+                                      print_step=print_step,
+                                      print_message='Finished inserting')
+
+        yield from itertuples
+
+
+def _streamed_itertuples(file: BinaryIO,
+                         sheet_name: Union[str, int]) -> Tuple[int, Iterable]:
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    if isinstance(sheet_name, int):
+        worksheet = workbook.worksheets[sheet_name]
+    else:
+        worksheet = workbook[sheet_name]
+
+    # Dimensions are only known if the file records them
+    total = worksheet.max_row - 1 if worksheet.max_row else None
 
-    total = df.shape[0] - 1
+    def itertuples() -> Generator:
+        try:
+            rows = worksheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
 
-    for i, itertuple in enumerate(df.itertuples(), 1):
-        if print_progress and not i % 1000:
-            print(f'Finished inserting {i}/{total}')
+            width = len(header)
+            row_type = namedtuple('Pandas',
+                                  ['Index', *(str(name) for name in header)],
+                                  rename=True)
+            for index, row in enumerate(rows):
+                row = row[:width] + (None,) * (width - len(row))
+                yield row_type(index,
+                               # Fix for converting NaN to None
+                               *(None if value != value else value
+                                 for value in row))
+        finally:
+            workbook.close()
 
-        yield itertuple
+    return total, itertuples()
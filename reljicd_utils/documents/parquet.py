@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import tempfile
+from itertools import islice
+from typing import (Any, Dict, Generator, Iterable, List, Optional, Tuple,
+                    Union)
+
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+from reljicd_utils.logger.logger import get_logger
+from reljicd_utils.utils.s3 import is_s3_path, open_path
+
+LOGGER = get_logger(__name__)
+
+ROW_GROUP_SIZE = 100000
+
+# Inferred schemas outlive the process, so later jobs over the same source
+# skip the spooling pass
+SCHEMA_CACHE_DIR: str = os.getenv(
+    key='PARQUET_SCHEMA_CACHE_DIR',
+    default=os.path.join(os.path.expanduser('~'), '.cache', 'reljicd_utils',
+                         'parquet_schemas'))
+
+_CONVERSION_ERRORS = (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError,
+                      pyarrow.ArrowNotImplementedError)
+
+
+def write_parquet(records: Iterable[Union[Dict, tuple]],
+                  destination: str,
+                  source: str = None,
+                  source_options: Dict[str, Any] = None,
+                  schema: pyarrow.Schema = None,
+                  row_group_size: int = ROW_GROUP_SIZE,
+                  compression: str = 'snappy') -> int:
+    """ Stream reader records into a Parquet file, one row group at a
+    time. Returns the number of rows written. """
+    # Schemas unified over all row groups are cached per local source file
+    # and reader options, until the file changes
+    key = _source_key(source, source_options)
+    schema = schema or _cached_schema(key)
+    if schema is not None:
+        rows = _write_direct(records, destination, schema, row_group_size,
+                             compression)
+    else:
+        rows, schema = _write_spooled(records, destination, row_group_size,
+                                      compression)
+        if key and schema is not None:
+            _cache_schema(key, schema)
+
+    LOGGER.info(f'Wrote {rows} rows to {destination}')
+    return rows
+
+
+def parquet_batch_generator(file: str,
+                            columns: List[str] = None,
+                            batch_size: int = 10000
+                            ) -> Generator[pyarrow.RecordBatch, None, None]:
+    with open_path(file, seekable=True) as f:
+        yield from pq.ParquetFile(f).iter_batches(batch_size=batch_size,
+                                                  columns=columns)
+
+
+def parquet_dict_generator(file: str,
+                           columns: List[str] = None,
+                           batch_size: int = 10000
+                           ) -> Generator[Dict, None, None]:
+    for batch in parquet_batch_generator(file, columns=columns,
+                                         batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def clear_schema_cache() -> None:
+    if os.path.isdir(SCHEMA_CACHE_DIR):
+        for name in os.listdir(SCHEMA_CACHE_DIR):
+            os.remove(os.path.join(SCHEMA_CACHE_DIR, name))
+
+
+def _write_direct(records: Iterable[Union[Dict, tuple]],
+                  destination: str,
+                  schema: pyarrow.Schema,
+                  row_group_size: int,
+                  compression: str) -> int:
+    rows = 0
+    with pq.ParquetWriter(destination, schema,
+                          compression=compression) as writer:
+        for chunk in _chunks(records, row_group_size):
+            writer.write_batch(_conform(_record_batch(chunk), schema),
+                               row_group_size=row_group_size)
+            rows += len(chunk)
+    return rows
+
+
+def _write_spooled(records: Iterable[Union[Dict, tuple]],
+                   destination: str,
+                   row_group_size: int,
+                   compression: str) -> Tuple[int, Optional[pyarrow.Schema]]:
+    rows = 0
+    schema = None
+    with tempfile.TemporaryDirectory() as spool:
+        spooled = []
+        for chunk in _chunks(records, row_group_size):
+            batch = _record_batch(chunk)
+            schema = batch.schema if schema is None else _unify(schema,
+                                                                batch.schema)
+            path = os.path.join(spool, f'{len(spooled)}.arrow')
+            with pyarrow.ipc.new_file(path, batch.schema) as writer:
+                writer.write_batch(batch)
+            spooled.append(path)
+            rows += len(chunk)
+
+        if schema is None:
+            return rows, None
+
+        # Columns that never had a value are written as strings
+        schema = pyarrow.schema(
+            [field.with_type(pyarrow.string())
+             if pyarrow.types.is_null(field.type) else field
+             for field in schema])
+        with pq.ParquetWriter(destination, schema,
+                              compression=compression) as writer:
+            for path in spooled:
+                with pyarrow.memory_map(path) as f:
+                    batch = pyarrow.ipc.open_file(f).get_batch(0)
+                    writer.write_batch(_conform(batch, schema),
+                                       row_group_size=row_group_size)
+                os.remove(path)
+    return rows, schema
+
+
+def _chunks(records: Iterable[Union[Dict, tuple]],
+            size: int) -> Generator[List[Dict], None, None]:
+    records = iter(records)
+    while True:
+        chunk = [_as_dict(record) for record in islice(records, size)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def _as_dict(record: Union[Dict, tuple]) -> Dict:
+    return record if isinstance(record, dict) else record._asdict()
+
+
+def _record_batch(chunk: List[Dict]) -> pyarrow.RecordBatch:
+    """ Column by column, so every key counts and a column whose values do
+    not share a type becomes a string column instead of failing """
+    columns = {}
+    for record in chunk:
+        for key in record:
+            columns.setdefault(key, None)
+
+    arrays = []
+    for column in columns:
+        values = [record.get(column) for record in chunk]
+        try:
+            arrays.append(pyarrow.array(values))
+        except _CONVERSION_ERRORS:
+            arrays.append(_string_array(values))
+    return pyarrow.RecordBatch.from_arrays(arrays, names=list(columns))
+
+
+def _unify(schema: pyarrow.Schema,
+           other: pyarrow.Schema) -> pyarrow.Schema:
+    fields = {field.name: field for field in schema}
+    for field in other:
+        current = fields.get(field.name)
+        if current is None:
+            fields[field.name] = field
+        elif current.type != field.type:
+            try:
+                fields[field.name] = pyarrow.unify_schemas(
+                    [pyarrow.schema([current]), pyarrow.schema([field])],
+                    promote_options='permissive').field(field.name)
+            except _CONVERSION_ERRORS:
+                # Conflicting types are written as strings, nested values
+                # as JSON
+                fields[field.name] = current.with_type(pyarrow.string())
+    return pyarrow.schema(list(fields.values()))
+
+
+def _conform(batch: pyarrow.RecordBatch,
+             schema: pyarrow.Schema) -> pyarrow.RecordBatch:
+    arrays = []
+    for field in schema:
+        index = batch.schema.get_field_index(field.name)
+        if index < 0:
+            arrays.append(pyarrow.nulls(batch.num_rows, field.type))
+        else:
+            arrays.append(_convert(batch.column(index), field.type))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _convert(array: pyarrow.Array,
+             type_: pyarrow.DataType) -> pyarrow.Array:
+    if array.type == type_:
+        return array
+    if pyarrow.types.is_string(type_) and pyarrow.types.is_nested(
+            array.type):
+        return _string_array(array.to_pylist())
+    try:
+        return array.cast(type_)
+    except _CONVERSION_ERRORS:
+        # e.g. a struct missing some of the unified struct's fields
+        try:
+            return pyarrow.array(array.to_pylist(), type=type_)
+        except _CONVERSION_ERRORS:
+            if pyarrow.types.is_string(type_):
+                return _string_array(array.to_pylist())
+            raise
+
+
+def _string_array(values: List) -> pyarrow.Array:
+    return pyarrow.array([_to_string(value) for value in values],
+                         type=pyarrow.string())
+
+
+def _to_string(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, default=str, ensure_ascii=False)
+    return str(value)
+
+
+def _source_key(source: Optional[str],
+                source_options: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not source or is_s3_path(source) or not os.path.isfile(source):
+        return None
+    stat = os.stat(source)
+    key = json.dumps([os.path.abspath(source), stat.st_mtime_ns,
+                      stat.st_size, source_options or {}],
+                     sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _cached_schema(key: Optional[str]) -> Optional[pyarrow.Schema]:
+    if not key:
+        return None
+    try:
+        with open(os.path.join(SCHEMA_CACHE_DIR, f'{key}.schema'),
+                  'rb') as f:
+            return pyarrow.ipc.read_schema(pyarrow.py_buffer(f.read()))
+    except (OSError, pyarrow.ArrowInvalid):
+        return None
+
+
+def _cache_schema(key: str, schema: pyarrow.Schema) -> None:
+    try:
+        os.makedirs(SCHEMA_CACHE_DIR, exist_ok=True)
+        path = os.path.join(SCHEMA_CACHE_DIR, f'{key}.schema')
+        # Written aside and renamed, so concurrent jobs never read half
+        temp = f'{path}.{os.getpid()}'
+        with open(temp, 'wb') as f:
+            f.write(schema.serialize().to_pybytes())
+        os.replace(temp, path)
+    except OSError as e:
+        LOGGER.warning(f'Could not cache Parquet schema: {e}')
@@ -0,0 +1,174 @@
+from collections import namedtuple
+from datetime import datetime
+from typing import Any, Callable, Collection, Dict, List, Union
+
+import pandas
+from pandas import DataFrame, Series, notnull
+from str2bool import str2bool
+
+from reljicd_utils.utils.date_time import parse_many
+
+INT = 'int'
+FLOAT = 'float'
+DATE = 'date'
+BOOL = 'bool'
+STR = 'str'
+OBJECT = 'object'
+
+DEFAULT_DATE_FORMAT = '%d/%m/%Y'
+
+
+class RecordSchema(object):
+    """ Column types declared or inferred once, converted column-wise.
+
+    ``types`` maps column names to ``int``, ``float``, ``date``, ``bool``,
+    ``str`` or ``object`` (values kept as they are); every type is
+    nullable. Dates are parsed with ``date_format`` (or
+    ``date_formats[column]``) and values that do not parse are kept as they
+    are. With ``as_tuples`` records are namedtuples instead of dicts.
+    """
+
+    def __init__(self,
+                 types: Dict[str, str],
+                 date_format: str = DEFAULT_DATE_FORMAT,
+                 date_formats: Dict[str, str] = None,
+                 as_tuples: bool = False):
+        self.types = dict(types)
+        self.date_formats = {column: (date_formats or {}).get(column,
+                                                              date_format)
+                             for column, type_ in self.types.items()
+                             if type_ == DATE}
+        self.as_tuples = as_tuples
+
+        self._column_converters: Dict[str, Callable[[Series], Series]] = {
+            column: _column_converter(type_, self.date_formats.get(column))
+            for column, type_ in self.types.items()}
+        self._value_converters: Dict[str, Callable[[Any], Any]] = {
+            column: _value_converter(type_, self.date_formats.get(column))
+            for column, type_ in self.types.items()}
+        self._record_types = {}
+
+    @classmethod
+    def infer(cls,
+              df: DataFrame,
+              date_columns: Collection[str] = None,
+              date_format: str = DEFAULT_DATE_FORMAT,
+              as_tuples: bool = False) -> 'RecordSchema':
+        """Schema from the dtypes of a sample chunk.
+
+        Without ``date_columns`` every column with ``date`` in its name is
+        a date column, as in ``BaseModel.insert_from_csv``.
+        """
+        types = {}
+        for column in df.columns:
+            is_date = (column in date_columns if date_columns is not None
+                       else 'date' in str(column))
+            kind = df[column].dtype.kind
+            if is_date:
+                types[column] = DATE
+            elif kind in 'iu':
+                types[column] = INT
+            elif kind == 'f':
+                types[column] = FLOAT
+            elif kind == 'b':
+                types[column] = BOOL
+            else:
+                types[column] = OBJECT
+        return cls(types, date_format=date_format, as_tuples=as_tuples)
+
+    def apply(self, df: DataFrame) -> DataFrame:
+        """ Object dtype frame of Python values, None for missing ones """
+        return DataFrame({column: self._column_converters.get(
+            column, python_objects)(df[column])
+            for column in df.columns}, index=df.index)
+
+    def records(self, df: DataFrame) -> List[Union[Dict, tuple]]:
+        df = self.apply(df)
+        if not self.as_tuples:
+            return df.to_dict('records')
+
+        record_type = self.record_type(df.columns)
+        return [record_type._make(row)
+                for row in df.itertuples(index=False, name=None)]
+
+    def convert_record(self, record: Dict) -> Union[Dict, tuple]:
+        """ Per value conversion for records that do not come in chunks """
+        converted = {key: (self._value_converters[key](value)
+                           if key in self._value_converters
+                           and value is not None else value)
+                     for key, value in record.items()}
+        if not self.as_tuples:
+            return converted
+
+        return self.record_type(self.types)(
+            *(converted.get(column) for column in self.types))
+
+    def record_type(self, columns: Collection[str]) -> type:
+        columns = tuple(columns)
+        record_type = self._record_types.get(columns)
+        if record_type is None:
+            # namedtuples have empty __slots__, so no per record __dict__
+            record_type = namedtuple('Record', [str(column)
+                                                for column in columns],
+                                     rename=True)
+            self._record_types[columns] = record_type
+        return record_type
+
+
+def _column_converter(type_: str,
+                      date_format: str = None) -> Callable[[Series], Series]:
+    if type_ == INT:
+        return lambda s: python_objects(
+            pandas.to_numeric(s, errors='coerce').astype('Int64'))
+    elif type_ == FLOAT:
+        return lambda s: python_objects(pandas.to_numeric(s,
+                                                           errors='coerce'))
+    elif type_ == DATE:
+        return lambda s: _convert_date(s, date_format)
+    elif type_ == BOOL:
+        return lambda s: python_objects(s.map(_to_bool, na_action='ignore'))
+    elif type_ == STR:
+        return lambda s: python_objects(s.map(str, na_action='ignore'))
+    elif type_ == OBJECT:
+        return python_objects
+    raise ValueError(f'Unknown column type: {type_}')
+
+
+def _value_converter(type_: str,
+                     date_format: str = None) -> Callable[[Any], Any]:
+    if type_ == INT:
+        return int
+    elif type_ == FLOAT:
+        return float
+    elif type_ == DATE:
+        return lambda value: _to_date(value, date_format)
+    elif type_ == BOOL:
+        return _to_bool
+    elif type_ == STR:
+        return str
+    elif type_ == OBJECT:
+        return lambda value: value
+    raise ValueError(f'Unknown column type: {type_}')
+
+
+def python_objects(
+        data: Union[Series, DataFrame]) -> Union[Series, DataFrame]:
+    # numpy scalars to Python ones (fix for psycopg) and NaN to None
+    return data.astype(object).where(notnull(data), None)
+
+
+def _convert_date(s: Series, date_format: str) -> Series:
+    dates = Series(parse_many(s, formats=[date_format]), index=s.index,
+                   dtype=object)
+    return python_objects(dates.where(notnull(dates), s))
+
+
+def _to_date(value: Any, date_format: str) -> Any:
+    try:
+        return datetime.strptime(value, date_format)
+    except (TypeError, ValueError):
+        return value
+
+
+def _to_bool(value: Any) -> Any:
+    return str2bool(value) if isinstance(value, str) else bool(value)
@@ -1,37 +1,433 @@
+import mmap
+import multiprocessing
+import os
 import re
-from typing import Dict, Generator, Union
+from typing import (BinaryIO, Collection, Dict, Generator, List, Optional,
+                    Pattern, Tuple, Union)
 
 import xmltodict
 from lxml import etree
-from lxml.etree import tostring
 
-from reljicd_utils.utils import read_file
+from reljicd_utils.documents.record_schema import RecordSchema
+from reljicd_utils.logger.logger import get_logger
+from reljicd_utils.multiprocessing.multiprocess import spawn_scope
+from reljicd_utils.utils.s3 import is_s3_path, open_path, open_source
+
+LOGGER = get_logger(__name__)
 
 
 def dict_from_xml_file(file: str) -> Dict[str, Union[Dict, str]]:
-    if file.startswith('s3'):
-        return xmltodict.parse(read_file(file))
-    else:
-        with open(file, 'r') as f:
-            return xmltodict.parse(f.read())
+    with open_path(file) as f:
+        return xmltodict.parse(f)
+
+
+def xml_dict_generator(file: str,
+                       tag: str,
+                       fields: Collection[str] = None,
+                       schema: RecordSchema = None
+                       ) -> Generator[Dict, None, None]:
+    with open_source(file) as source:
+        yield from _iterparse_dicts(source, tag=tag, fields=fields,
+                                    schema=schema)
+
+
+def xml_record_shards(file: str,
+                      tag: str,
+                      num_of_shards: int) -> List[Tuple[int, int]]:
+    """(offset, length) byte ranges of ``file``, each starting at a record.
+
+    Records must be ``tag`` elements under one common parent and must not
+    contain ``tag`` elements themselves. Namespace prefixes of ``tag`` are
+    taken from the root element's declarations.
+    """
+    with open(file, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pattern = _tag_pattern(tag, _root_namespaces(mm)[0])
+        first = _next_record(mm, pattern, 0, len(mm))
+        if first is None:
+            return []
+        records_end = _records_end(mm, _open_elements(mm[:first]))
+
+        offsets = [first]
+        for i in range(1, num_of_shards):
+            position = max(first + (records_end - first) * i // num_of_shards,
+                           offsets[-1] + 1)
+            offset = _next_record(mm, pattern, position, records_end)
+            # The scan may have started inside a comment or CDATA section
+            while offset is not None:
+                markup_end = _enclosing_markup_end(mm, offset)
+                if markup_end is None:
+                    break
+                offset = _next_record(mm, pattern, markup_end, records_end)
+            if offset is None:
+                break
+            offsets.append(offset)
+
+    return [(offset, next_offset - offset)
+            for offset, next_offset in zip(offsets, offsets[1:] +
+                                           [records_end])]
+
 
+def xml_shard_dict_generator(file: str,
+                             tag: str,
+                             offset: int,
+                             length: int,
+                             fields: Collection[str] = None,
+                             schema: RecordSchema = None
+                             ) -> Generator[Dict, None, None]:
+    """ Same dicts as ``xml_dict_generator``, for the records of one shard """
+    with open(file, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pattern = _tag_pattern(tag, _root_namespaces(mm)[0])
+            first = _next_record(mm, pattern, 0, len(mm))
+            header = mm[:first]
+        footer = ''.join(f'</{name}>'
+                         for name in reversed(_open_elements(header)))
 
-def xml_dict_generator(file: str, tag: str) -> Generator[Dict, None, None]:
-    context = etree.iterparse(file, tag=tag)
+        # Prolog and enclosing start tags, the shard, then closing tags
+        source = _ByteRangesReader(f, [(0, first), (offset, length),
+                                       footer.encode()])
+        yield from _iterparse_dicts(source, tag=tag, fields=fields,
+                                    schema=schema)
+
+
+def _iterparse_dicts(source: Union[str, BinaryIO],
+                     tag: str,
+                     fields: Collection[str] = None,
+                     schema: RecordSchema = None
+                     ) -> Generator[Dict, None, None]:
+    context = etree.iterparse(source, tag=tag)
     for _, elem in context:
-        yield xmltodict.parse(tostring(elem))[tag]
-        elem.clear()
+        record = element_to_dict(elem, fields=fields)
+        yield schema.convert_record(record) if schema else record
+        _release(elem)
+
+
+def element_to_dict(elem: etree._Element,
+                    fields: Collection[str] = None,
+                    root: bool = True) -> Union[Dict, str, None]:
+    """xmltodict compatible conversion of a parsed element.
+
+    Attributes become ``@`` keys, text becomes ``#text`` (or the value
+    itself for plain text elements) and repeated children become lists.
+    ``fields`` limits the attributes and children of ``elem`` that are
+    converted, so unneeded subtrees are skipped entirely.
+    """
+    result = {}
+
+    # tostring() of a record declares every namespace in scope on it
+    parent = None if root else elem.getparent()
+    inherited = {} if parent is None else parent.nsmap
+    for prefix, uri in elem.nsmap.items():
+        if inherited.get(prefix) != uri:
+            key = f'@xmlns:{prefix}' if prefix else '@xmlns'
+            if fields is None or key in fields:
+                result[key] = uri
+
+    for name, value in elem.attrib.items():
+        key = f'@{_qualified_name(elem, name)}'
+        if fields is None or key in fields:
+            result[key] = value
+
+    texts = [elem.text] if elem.text else []
+    for child in elem:
+        if child.tail:
+            texts.append(child.tail)
+        if not isinstance(child.tag, str):  # Comments and PIs
+            continue
+
+        key = _element_name(child)
+        if fields is not None and key not in fields:
+            continue
 
+        value = element_to_dict(child, root=False)
+        if key not in result:
+            result[key] = value
+        elif isinstance(result[key], list):
+            result[key].append(value)
+        else:
+            result[key] = [result[key], value]
 
-def count_tags(file: str, tag: str) -> int:
-    context = etree.iterparse(file, tag=tag)
+    text = ''.join(texts).strip() or None
+    if not result:
+        return text
+    if text is not None:
+        result['#text'] = text
+    return result
+
+
+def _element_name(elem: etree._Element) -> str:
+    local_name = etree.QName(elem).localname
+    return f'{elem.prefix}:{local_name}' if elem.prefix else local_name
+
+
+def _qualified_name(elem: etree._Element, name: str) -> str:
+    if not name.startswith('{'):
+        return name
+    uri, local_name = name[1:].split('}', 1)
+    for prefix, prefix_uri in elem.nsmap.items():
+        if prefix and prefix_uri == uri:
+            return f'{prefix}:{local_name}'
+    return local_name
+
+
+def _release(elem: etree._Element) -> None:
+    # clear() alone leaves the emptied element attached to its parent
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+def count_tags(file: str,
+               tag: str,
+               fast: bool = False,
+               num_of_processes: int = 1,
+               verify: bool = False) -> int:
+    """Number of ``tag`` elements in ``file``.
+
+    ``fast`` scans the raw bytes over an mmap for opening tags instead of
+    parsing, skipping comments and CDATA sections, and splits the file
+    into byte ranges counted by ``num_of_processes`` processes. Prefixes
+    are resolved from the root element; files declaring namespaces
+    elsewhere are counted with iterparse. ``verify``
+    compares the fast count with the iterparse one, logs any mismatch and
+    returns the iterparse count. S3 paths are always counted with
+    iterparse.
+    """
+    if not fast or is_s3_path(file):
+        return _count_tags_iterparse(file, tag)
+
+    counter = _count_tags_fast(file, tag, num_of_processes=num_of_processes)
+    if verify:
+        expected = _count_tags_iterparse(file, tag)
+        if counter != expected:
+            LOGGER.warning(f'Fast count of {tag} in {file} is {counter}, '
+                           f'iterparse counted {expected}')
+        return expected
+    return counter
+
+
+def _count_tags_iterparse(file: str, tag: str) -> int:
     counter = 0
-    for _, elem in context:
-        counter += 1
-        elem.clear()
+    with open_source(file) as source:
+        for _, elem in etree.iterparse(source, tag=tag):
+            counter += 1
+            _release(elem)
     return counter
 
 
+# Scanner states at a byte range boundary
+NORMAL, IN_COMMENT, IN_CDATA = range(3)
+_TERMINATORS = {IN_COMMENT: b'-->', IN_CDATA: b']]>'}
+
+
+def _count_tags_fast(file: str, tag: str, num_of_processes: int = 1) -> int:
+    if not os.path.getsize(file):
+        return 0
+
+    with open(file, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        namespaces, redeclared = _root_namespaces(mm)
+        if redeclared:
+            # Prefixes can only be resolved from the root element's
+            # declarations
+            LOGGER.info(f'{file} declares namespaces below its root, '
+                        f'counting {tag} with iterparse')
+            return _count_tags_iterparse(file, tag)
+
+        pattern = _tag_pattern(tag, namespaces)
+        ranges = _byte_ranges(mm, num_of_processes)
+        if len(ranges) > 1:
+            with spawn_scope():
+                with multiprocessing.Pool(processes=num_of_processes) as p:
+                    results = p.starmap(_count_range,
+                                        [(file, tag, namespaces, start, end)
+                                         for start, end in ranges])
+        else:
+            results = [_scan(mm, pattern, *ranges[0])]
+
+        # Ranges are counted as if they start outside comments and CDATA;
+        # the rare one that does not is rescanned here
+        counter = 0
+        state = NORMAL
+        for (start, end), (count, end_state) in zip(ranges, results):
+            if state != NORMAL:
+                count, end_state = _scan(mm, pattern, start, end, state)
+            counter += count
+            state = end_state
+
+    return counter
+
+
+def _tag_pattern(tag: str, namespaces: Dict[str, str]) -> Pattern[bytes]:
+    """ Opening tags of ``tag`` (``{uri}local`` or ``local``) under the
+    prefixes ``namespaces`` bind to its namespace """
+    uri, local_name = tag[1:].split('}', 1) if tag[:1] == '{' else ('', tag)
+    prefixes = [prefix for prefix, bound in namespaces.items()
+                if bound == uri]
+    if not uri and '' not in namespaces:
+        prefixes.append('')
+    names = b'|'.join(re.escape(f'{prefix}:{local_name}' if prefix
+                                else local_name).encode()
+                      for prefix in prefixes)
+    return re.compile(rb'(?P<comment><!--.*?-->)'
+                      rb'|(?P<cdata><!\[CDATA\[.*?\]\]>)'
+                      rb'|(?P<tag><(?:' + (names or rb'(?!)') +
+                      rb')(?=[\s/>]))',
+                      re.DOTALL)
+
+
+def _root_namespaces(mm: mmap.mmap) -> Tuple[Dict[str, str], bool]:
+    """ Prefix to URI bindings declared on the root element, and whether
+    the file declares namespaces anywhere else """
+    parser = etree.XMLPullParser(events=('start-ns', 'start'))
+    namespaces = {}
+    for position in range(0, len(mm), 2 ** 16):
+        parser.feed(mm[position:position + 2 ** 16])
+        for event, value in parser.read_events():
+            if event == 'start':
+                others = _declarations(mm, len(namespaces) + 1)
+                return namespaces, others > len(namespaces)
+            prefix, uri = value
+            namespaces[prefix] = uri
+    return namespaces, False
+
+
+def _declarations(mm: mmap.mmap, limit: int) -> int:
+    """ Occurrences of "xmlns" in the file, counted up to ``limit``. Any
+    beyond the root's declarations may rebind a prefix """
+    count = 0
+    position = mm.find(b'xmlns')
+    while position != -1 and count < limit:
+        count += 1
+        position = mm.find(b'xmlns', position + 5)
+    return count
+
+
+def _byte_ranges(mm: mmap.mmap, num_of_ranges: int) -> List[Tuple[int, int]]:
+    size = len(mm)
+    boundaries = [0]
+    for i in range(1, num_of_ranges):
+        boundary = size * i // num_of_ranges
+        # A comment or CDATA terminator must not straddle a boundary
+        while boundary < size and mm[boundary - 1] in b'-]':
+            boundary += 1
+        if boundaries[-1] < boundary < size:
+            boundaries.append(boundary)
+    boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def _next_record(mm: mmap.mmap,
+                 pattern: Pattern[bytes],
+                 start: int,
+                 end: int) -> Optional[int]:
+    for match in pattern.finditer(mm, start):
+        if match.start() >= end:
+            break
+        if match.lastgroup == 'tag':
+            return match.start()
+    return None
+
+
+def _enclosing_markup_end(mm: mmap.mmap, position: int) -> Optional[int]:
+    """ End of the comment or CDATA section around position, if any """
+    for opener, terminator in ((b'<!--', b'-->'), (b'<![CDATA[', b']]>')):
+        start = mm.rfind(opener, 0, position)
+        if start != -1 and mm.find(terminator, start, position) == -1:
+            end = mm.find(terminator, position)
+            return len(mm) if end == -1 else end + len(terminator)
+    return None
+
+
+def _open_elements(header: bytes) -> List[str]:
+    """ Qualified names of the elements still open at the end of header """
+    parser = etree.XMLPullParser(events=('start', 'end'))
+    parser.feed(header)
+    names = []
+    for event, elem in parser.read_events():
+        if event == 'start':
+            names.append(_element_name(elem))
+        else:
+            names.pop()
+    return names
+
+
+def _records_end(mm: mmap.mmap, open_elements: List[str]) -> int:
+    if not open_elements:
+        return len(mm)
+    end = mm.rfind(f'</{open_elements[-1]}'.encode())
+    return end if end != -1 else len(mm)
+
+
+class _ByteRangesReader(object):
+    """ File-like concatenation of (offset, length) ranges and bytes """
+
+    def __init__(self, file: BinaryIO, segments: List):
+        self._file = file
+        self._segments = list(segments)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(2 ** 20), b''))
+
+        while self._segments:
+            segment = self._segments[0]
+            if isinstance(segment, bytes):
+                data, remaining = segment[:size], segment[size:]
+            else:
+                offset, length = segment
+                self._file.seek(offset)
+                data = self._file.read(min(size, length))
+                remaining = ((offset + len(data), length - len(data))
+                             if data and len(data) < length else None)
+
+            if remaining:
+                self._segments[0] = remaining
+            else:
+                self._segments.pop(0)
+            if data:
+                return data
+        return b''
+
+
+def _count_range(file: str,
+                 tag: str,
+                 namespaces: Dict[str, str],
+                 start: int,
+                 end: int) -> Tuple[int, int]:
+    with open(file, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return _scan(mm, _tag_pattern(tag, namespaces), start, end)
+
+
+def _scan(mm: mmap.mmap,
+          pattern: Pattern[bytes],
+          start: int,
+          end: int,
+          state: int = NORMAL) -> Tuple[int, int]:
+    """ Opening tags starting in [start, end) and the state at ``end`` """
+    position = start
+    if state != NORMAL:
+        terminator = mm.find(_TERMINATORS[state], start, end)
+        if terminator == -1:
+            return 0, state
+        position = terminator + 3
+
+    counter = 0
+    state = NORMAL
+    for match in pattern.finditer(mm, position):
+        if match.start() >= end:
+            break
+        if match.lastgroup == 'tag':
+            counter += 1
+        elif match.end() > end:
+            state = IN_COMMENT if match.lastgroup == 'comment' else IN_CDATA
+    return counter, state
+
+
 TAG_RE = re.compile(r'<[^>]+>')
 
 
@@ -1,2 +1,3 @@
 from reljicd_utils.file_system.file_processor import *
 from reljicd_utils.file_system.file_system import *
+from reljicd_utils.file_system.journal import *
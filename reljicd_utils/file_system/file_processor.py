@@ -1,11 +1,22 @@
-import itertools
+import asyncio
+import functools
 import os
-from typing import Callable, List
+import pickle
+import time
+import traceback
+from multiprocessing.pool import RemoteTraceback
+from typing import (Callable, Collection, Dict, Generator, Iterable, List,
+                    NamedTuple, Optional, Tuple, Union)
 
+from reljicd_utils.documents.xml import (xml_record_shards,
+                                         xml_shard_dict_generator)
 from reljicd_utils.file_system.file_system import (files_in_dir,
                                                    files_in_dir_recursive)
+from reljicd_utils.file_system.journal import Journal
 from reljicd_utils.logger.logger import get_logger
-from reljicd_utils.multiprocessing.multiprocess import multiprocess
+from reljicd_utils.multiprocessing.accounting import TaskAccounting
+from reljicd_utils.multiprocessing.executors import ASYNCIO, PROCESS
+from reljicd_utils.multiprocessing.multiprocess import multiprocess, pmap
 from reljicd_utils.utils import s3
 
 LOGGER = get_logger(__name__)
@@ -16,24 +27,196 @@ def process_path(path: str,
                  extension: str = '*',
                  recursive: bool = False,
                  num_of_processes: int = 1,
-                 files_per_process: int = 1,
+                 files_per_process: Union[int, str] = 1,
                  continue_from: int = 1,
                  log_every=1000,
-                 spawn=False) -> None:
+                 spawn=False,
+                 journal: str = None,
+                 retries: int = 0,
+                 backoff: float = 1.0,
+                 backend: str = PROCESS,
+                 initializer: Callable = None,
+                 initargs: Tuple = (),
+                 maxtasksperchild: int = None,
+                 max_rss_mb: float = None,
+                 report_top: int = None) -> None:
+    """ Call ``func`` on every file in ``path``, retrying failed files
+    and, with ``journal``, skipping the ones completed by earlier runs """
     files = files_in_path(path=path,
                           recursive=recursive,
                           extension=extension)
 
-    files = itertools.islice(files, continue_from - 1, None)
+    files = files[continue_from - 1:]
+    pool_options = dict(backend=backend, initializer=initializer,
+                        initargs=initargs, maxtasksperchild=maxtasksperchild,
+                        max_rss_mb=max_rss_mb,
+                        accounting=(TaskAccounting(top=report_top)
+                                    if report_top else None))
+
+    if journal is None:
+        outcomes = _process_files(func, files, len(files), num_of_processes,
+                                  files_per_process, log_every, spawn,
+                                  retries, backoff, pool_options)
+        for outcome in outcomes:
+            if outcome.error is not None:
+                message = (f'Processing {outcome.item} failed after '
+                           f'{outcome.attempts} attempts')
+                if outcome.exception is None:
+                    raise RuntimeError(f'{message}:\n{outcome.error}')
+                LOGGER.error(message)
+                # Chained like Pool does, so the worker traceback is shown
+                exception = pickle.loads(outcome.exception)
+                raise exception from RemoteTraceback(outcome.error)
+    else:
+        with Journal(journal) as j:
+            completed = j.completed()
+            LOGGER.info(f'{len(completed)} files already completed')
+            files = [file for file in files if file not in completed]
+            outcomes = _process_files(func, _journaled(j, files),
+                                      len(files), num_of_processes,
+                                      files_per_process, log_every, spawn,
+                                      retries, backoff, pool_options)
+            for outcome in outcomes:
+                if outcome.error is None:
+                    j.complete(outcome.item, outcome.duration,
+                               outcome.attempts)
+                else:
+                    LOGGER.error(f'Processing {outcome.item} failed after '
+                                 f'{outcome.attempts} attempts:\n'
+                                 f'{outcome.error}')
+                    j.fail(outcome.item, outcome.error, outcome.duration,
+                           outcome.attempts)
+            LOGGER.info(f'Journal {journal}: {j.summary()}')
+
+    if pool_options['accounting']:
+        pool_options['accounting'].log_report()
+
+    LOGGER.info("Done")
+
+
+class _Outcome(NamedTuple):
+    item: str
+    duration: float
+    attempts: int
+    # Traceback text of the last failure
+    error: Optional[str] = None
+    # The pickled exception, None if it does not survive a round trip.
+    # Shipped as bytes, as an exception failing to unpickle in the Pool's
+    # result handler thread would hang the run
+    exception: Optional[bytes] = None
+
+
+def _process_files(func: Callable,
+                   files: Iterable[str],
+                   total: int,
+                   num_of_processes: int,
+                   files_per_process: Union[int, str],
+                   log_every: int,
+                   spawn: bool,
+                   retries: int,
+                   backoff: float,
+                   pool_options: Dict) -> Generator[_Outcome, None, None]:
+    run = (_run_with_retries_async if pool_options['backend'] == ASYNCIO
+           else _run_with_retries)
+    return pmap(functools.partial(run, func, retries, backoff),
+                files, workers=num_of_processes, ordered=False,
+                chunk_size=files_per_process, total=total, spawn=spawn,
+                print_progress=True, print_step=log_every, **pool_options)
+
+
+def _journaled(journal: Journal,
+               files: Iterable[str]) -> Generator[str, None, None]:
+    # Marked in progress as they are handed to the workers
+    for file in files:
+        journal.start(file)
+        yield file
 
-    multiprocess(func, files, num_of_processes=num_of_processes,
-                 map_chunk_size=files_per_process, spawn=spawn,
-                 print_step=log_every,
-                 print_progress=True)
+
+def _run_with_retries(func: Callable,
+                      retries: int,
+                      backoff: float,
+                      item: str) -> _Outcome:
+    start = time.perf_counter()
+    for attempt in range(retries + 1):
+        try:
+            func(item)
+            return _Outcome(item, time.perf_counter() - start, attempt + 1)
+        except Exception as e:
+            error, exception = traceback.format_exc(), e
+            if attempt < retries:
+                LOGGER.warning(f'Processing {item} failed, retrying in '
+                               f'{backoff * 2 ** attempt}s')
+                time.sleep(backoff * 2 ** attempt)
+    return _Outcome(item, time.perf_counter() - start, retries + 1, error,
+                    _pickled(exception))
+
+
+async def _run_with_retries_async(func: Callable,
+                                  retries: int,
+                                  backoff: float,
+                                  item: str) -> _Outcome:
+    start = time.perf_counter()
+    for attempt in range(retries + 1):
+        try:
+            await func(item)
+            return _Outcome(item, time.perf_counter() - start, attempt + 1)
+        except Exception as e:
+            error, exception = traceback.format_exc(), e
+            if attempt < retries:
+                LOGGER.warning(f'Processing {item} failed, retrying in '
+                               f'{backoff * 2 ** attempt}s')
+                await asyncio.sleep(backoff * 2 ** attempt)
+    return _Outcome(item, time.perf_counter() - start, retries + 1, error,
+                    _pickled(exception))
+
+
+def _pickled(exception: BaseException) -> Optional[bytes]:
+    # Exceptions whose __init__ takes other arguments dump but do not load
+    try:
+        pickled = pickle.dumps(exception)
+        pickle.loads(pickled)
+    except Exception:
+        return None
+    return pickled
+
+
+def process_xml_file(file: str,
+                     tag: str,
+                     func: Callable[[Dict], None],
+                     num_of_processes: int = 1,
+                     num_of_shards: int = None,
+                     fields: Collection[str] = None,
+                     spawn=False) -> None:
+    """Call ``func`` on every ``tag`` record dict of one large XML file.
+
+    The file is split into record aligned byte ranges, parsed in parallel
+    by ``num_of_processes`` workers without being rewritten to disk.
+    """
+    shards = xml_record_shards(file, tag=tag,
+                               num_of_shards=(num_of_shards or
+                                              num_of_processes * 4))
+    LOGGER.info(f'Processing {file} in {len(shards)} shards')
+
+    multiprocess(functools.partial(_process_xml_shard, file, tag, func,
+                                   fields),
+                 shards, num_of_processes=num_of_processes,
+                 map_chunk_size=1, spawn=spawn)
 
     LOGGER.info("Done")
 
 
+def _process_xml_shard(file: str,
+                       tag: str,
+                       func: Callable[[Dict], None],
+                       fields: Collection[str],
+                       shard: Tuple[int, int]) -> None:
+    counter = 0
+    for record in xml_shard_dict_generator(file, tag, *shard, fields=fields):
+        func(record)
+        counter += 1
+    LOGGER.info(f'Shard {shard} of {file}: {counter} records')
+
+
 def files_in_path(path: str,
                   extension: str = '*',
                   recursive: bool = False) -> List[str]:
@@ -0,0 +1,85 @@
+import sqlite3
+import time
+from typing import Dict, Optional, Set
+
+IN_PROGRESS = 'in_progress'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    item TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started_at REAL,
+    finished_at REAL,
+    duration REAL,
+    error TEXT
+)
+"""
+
+
+class Journal(object):
+    """ SQLite record of completed, failed and in-progress work items.
+
+    Only the parent process writes to it; workers report back their
+    outcome. Items left ``in_progress`` by a crashed run are simply not
+    completed, so a resumed run processes them again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(SCHEMA)
+
+    def __enter__(self) -> 'Journal':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def completed(self) -> Set[str]:
+        return {item for item, in self._connection.execute(
+            'SELECT item FROM items WHERE status = ?', (COMPLETED,))}
+
+    def status(self, item: str) -> Optional[str]:
+        row = self._connection.execute(
+            'SELECT status FROM items WHERE item = ?', (item,)).fetchone()
+        return row[0] if row else None
+
+    def start(self, item: str) -> None:
+        self._connection.execute(
+            'INSERT INTO items (item, status, started_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (item) DO UPDATE SET status = excluded.status, '
+            'started_at = excluded.started_at, finished_at = NULL, '
+            'duration = NULL, error = NULL',
+            (item, IN_PROGRESS, time.time()))
+
+    def complete(self, item: str, duration: float, attempts: int = 1) -> None:
+        self._finish(item, COMPLETED, duration, attempts)
+
+    def fail(self,
+             item: str,
+             error: str,
+             duration: float,
+             attempts: int = 1) -> None:
+        self._finish(item, FAILED, duration, attempts, error)
+
+    def summary(self) -> Dict[str, int]:
+        return dict(self._connection.execute(
+            'SELECT status, COUNT(*) FROM items GROUP BY status'))
+
+    def _finish(self,
+                item: str,
+                status: str,
+                duration: float,
+                attempts: int,
+                error: str = None) -> None:
+        self._connection.execute(
+            'UPDATE items SET status = ?, attempts = attempts + ?, '
+            'finished_at = ?, duration = ?, error = ? WHERE item = ?',
+            (status, attempts, time.time(), duration, error, item))
@@ -1 +1,5 @@
+from reljicd_utils.multiprocessing.accounting import *
+from reljicd_utils.multiprocessing.chunking import *
+from reljicd_utils.multiprocessing.executors import *
 from reljicd_utils.multiprocessing.multiprocess import *
+from reljicd_utils.multiprocessing.shared import *
@@ -0,0 +1,106 @@
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from reljicd_utils.logger.logger import get_logger
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+LOGGER = get_logger(__name__)
+
+METRICS = ('wall_seconds', 'cpu_seconds', 'peak_rss_delta')
+
+
+class TaskStats(NamedTuple):
+    item: str
+    wall_seconds: float
+    cpu_seconds: float
+    # Growth of the worker's peak RSS while processing the item, in bytes
+    peak_rss_delta: int
+
+
+class TaskAccounting(object):
+    """ Per item resource usage reported by the workers.
+
+    Totals cover every item; only the ``top`` heaviest items per metric are
+    kept, so memory stays bounded on long runs.
+    """
+
+    def __init__(self, top: int = 10):
+        self.top_n = top
+        self.items = 0
+        self.totals = dict.fromkeys(METRICS, 0)
+        self._heaviest: Dict[str, List] = {metric: [] for metric in METRICS}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def record(self, stats: Iterable[TaskStats]) -> None:
+        with self._lock:
+            for task in stats:
+                self.items += 1
+                order = next(self._counter)
+                for metric in METRICS:
+                    value = getattr(task, metric)
+                    self.totals[metric] += value
+                    heap = self._heaviest[metric]
+                    if len(heap) < self.top_n:
+                        heapq.heappush(heap, (value, order, task))
+                    elif value > heap[0][0]:
+                        heapq.heapreplace(heap, (value, order, task))
+
+    def top(self,
+            metric: str = 'wall_seconds',
+            n: int = None) -> List[TaskStats]:
+        with self._lock:
+            heaviest = sorted(self._heaviest[metric], reverse=True)
+        return [task for _, _, task in heaviest[:n or self.top_n]]
+
+    def log_report(self, n: int = None) -> None:
+        LOGGER.info(f'{self.items} items, '
+                    f'wall {self.totals["wall_seconds"]:.1f}s, '
+                    f'cpu {self.totals["cpu_seconds"]:.1f}s')
+        for metric in METRICS:
+            lines = '\n'.join(
+                f'  {task.wall_seconds:10.3f}s wall '
+                f'{task.cpu_seconds:10.3f}s cpu '
+                f'{task.peak_rss_delta / 2 ** 20:10.1f} MB peak RSS  '
+                f'{task.item}'
+                for task in self.top(metric, n))
+            LOGGER.info(f'Heaviest items by {metric}:\n{lines}')
+
+
+def task_stats(item: Any, wall: float, cpu: float, peak: int) -> TaskStats:
+    """ Stats of ``item`` from the counters read before processing it """
+    return TaskStats(_label(item),
+                     time.perf_counter() - wall,
+                     time.thread_time() - cpu,
+                     peak_rss() - peak)
+
+
+def rss() -> Optional[int]:
+    """ Current resident set size of this process in bytes, if known """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss() -> int:
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _label(item: Any, length: int = 200) -> str:
+    label = str(item)
+    return label if len(label) <= length else label[:length - 3] + '...'
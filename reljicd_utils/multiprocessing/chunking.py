@@ -0,0 +1,77 @@
+import math
+import threading
+
+AUTO = 'auto'
+
+
+class AdaptiveChunker(object):
+    """ Batch sizes tuned from measured task latency.
+
+    ``record`` is called with the compute time a worker spent on a batch
+    and the round trip time seen by the parent. The smallest observed
+    difference between the two is taken as the fixed per batch IPC cost.
+    Batches are sized so they take ``target_seconds`` of compute, or at
+    least ten times the IPC cost, and grow at most twofold per batch. When
+    ``total`` is known, batches shrink near the end of the input so every
+    worker gets ``tail_batches_per_worker`` batches of what is left.
+    """
+
+    def __init__(self,
+                 workers: int,
+                 target_seconds: float = 0.2,
+                 min_size: int = 1,
+                 max_size: int = 10000,
+                 total: int = None,
+                 tail_batches_per_worker: int = 2,
+                 smoothing: float = 0.3):
+        self.workers = workers
+        self.target_seconds = target_seconds
+        self.min_size = min_size
+        self.max_size = max_size
+        self.total = total
+        self.tail_batches_per_worker = tail_batches_per_worker
+        self.smoothing = smoothing
+
+        self.size = min_size
+        self.dispatched = 0
+        self.item_seconds = None
+        self.overhead_seconds = None
+        self._lock = threading.Lock()
+
+    def next_size(self) -> int:
+        with self._lock:
+            size = self.size
+            if self.total is not None:
+                remaining = self.total - self.dispatched
+                size = min(size, math.ceil(
+                    remaining / (self.workers *
+                                 self.tail_batches_per_worker)))
+            size = max(size, self.min_size)
+            self.dispatched += size
+            return size
+
+    def record(self,
+               items: int,
+               compute_seconds: float,
+               round_trip_seconds: float) -> None:
+        if not items:
+            return
+
+        with self._lock:
+            item_seconds = compute_seconds / items
+            if self.item_seconds is None:
+                self.item_seconds = item_seconds
+            else:
+                self.item_seconds += self.smoothing * (item_seconds -
+                                                       self.item_seconds)
+
+            overhead = max(round_trip_seconds - compute_seconds, 0.0)
+            if self.overhead_seconds is None or \
+                    overhead < self.overhead_seconds:
+                self.overhead_seconds = overhead
+
+            target = max(self.target_seconds, 10 * self.overhead_seconds)
+            size = (target / self.item_seconds if self.item_seconds
+                    else self.max_size)
+            self.size = int(max(self.min_size,
+                                min(size, 2 * self.size, self.max_size)))
@@ -0,0 +1,170 @@
+import asyncio
+import inspect
+import multiprocessing
+import multiprocessing.pool
+import os
+import sys
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Generator, Tuple, Union
+
+from str2bool import str2bool
+
+SPAWN: bool = str2bool(os.getenv(key='SPAWN', default='False'))
+
+PROCESS = 'process'
+THREAD = 'thread'
+ASYNCIO = 'asyncio'
+BACKENDS = (PROCESS, THREAD, ASYNCIO)
+
+
+@contextmanager
+def spawn_scope(spawn: bool = None):
+    if spawn is None:
+        spawn = SPAWN
+
+    if spawn:
+        multiprocessing.set_start_method('spawn', force=True)
+
+    yield
+
+    if spawn:
+        if sys.platform != "win32":
+            multiprocessing.set_start_method('fork', force=True)
+
+
+class FutureResult(object):
+    """ ``AsyncResult`` like view of a ``concurrent.futures.Future`` """
+
+    def __init__(self, future: Future):
+        self._future = future
+
+    def get(self, timeout: float = None) -> Any:
+        return self._future.result(timeout=timeout)
+
+    def ready(self) -> bool:
+        return self._future.done()
+
+
+class AsyncioExecutor(object):
+    """ Pool like runner of coroutine functions.
+
+    Coroutines run on an event loop in a background thread, at most
+    ``workers`` of them at a time. ``initializer`` (a function or a
+    coroutine function) runs once on the loop before any task.
+    ``apply_async`` has the signature and callback semantics of
+    ``multiprocessing.Pool.apply_async``; leaving the context cancels
+    whatever is still running.
+    """
+
+    def __init__(self,
+                 workers: int,
+                 initializer: Callable = None,
+                 initargs: Tuple = ()):
+        self.workers = workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+
+    def __enter__(self) -> 'AsyncioExecutor':
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name='AsyncioExecutor', daemon=True)
+        self._thread.start()
+        if self.initializer is not None:
+            asyncio.run_coroutine_threadsafe(self._initialize(),
+                                             self._loop).result()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.terminate()
+
+    def apply_async(self,
+                    func: Callable,
+                    args: Tuple = (),
+                    callback: Callable[[Any], None] = None,
+                    error_callback: Callable[[BaseException], None] = None
+                    ) -> FutureResult:
+        future = asyncio.run_coroutine_threadsafe(self._run(func, args),
+                                                  self._loop)
+
+        def done(f: Future) -> None:
+            if f.cancelled():
+                return
+            error = f.exception()
+            if error is None:
+                if callback:
+                    callback(f.result())
+            elif error_callback:
+                error_callback(error)
+
+        future.add_done_callback(done)
+        return FutureResult(future)
+
+    def terminate(self) -> None:
+        if self._loop is None:
+            return
+
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+        pending = asyncio.all_tasks(self._loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            self._loop.run_until_complete(
+                asyncio.gather(*pending, return_exceptions=True))
+        self._loop.close()
+        self._loop = None
+        self._semaphore = None
+
+    async def _initialize(self) -> None:
+        result = self.initializer(*self.initargs)
+        if inspect.isawaitable(result):
+            await result
+
+    async def _run(self, func: Callable, args: Tuple) -> Any:
+        if self._semaphore is None:
+            # Created on the loop thread, so it binds to the right loop
+            self._semaphore = asyncio.Semaphore(self.workers)
+        async with self._semaphore:
+            return await func(*args)
+
+
+Executor = Union[multiprocessing.pool.Pool, AsyncioExecutor]
+
+
+@contextmanager
+def executor(backend: str = PROCESS,
+             workers: int = os.cpu_count(),
+             spawn: bool = None,
+             initializer: Callable = None,
+             initargs: Tuple = (),
+             maxtasksperchild: int = None) -> Generator[Executor, None, None]:
+    """Pool of ``workers`` for ``backend``: a process pool, a thread pool or
+    an ``AsyncioExecutor``, all driven through ``apply_async``.
+    ``initializer(*initargs)`` runs once in every worker process or thread,
+    or once on the event loop. ``maxtasksperchild`` only applies to
+    processes. """
+    if backend == PROCESS:
+        with spawn_scope(spawn=spawn):
+            with multiprocessing.Pool(processes=workers,
+                                      initializer=initializer,
+                                      initargs=initargs,
+                                      maxtasksperchild=maxtasksperchild) as p:
+                yield p
+    elif backend == THREAD:
+        with multiprocessing.pool.ThreadPool(processes=workers,
+                                             initializer=initializer,
+                                             initargs=initargs) as p:
+            yield p
+    elif backend == ASYNCIO:
+        with AsyncioExecutor(workers=workers, initializer=initializer,
+                             initargs=initargs) as p:
+            yield p
+    else:
+        raise ValueError(f'Unknown backend: {backend}, '
+                         f'expected one of {BACKENDS}')
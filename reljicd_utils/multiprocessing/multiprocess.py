@@ -1,55 +1,322 @@
+import functools
+import inspect
+import itertools
 import multiprocessing
 import os
-import sys
-from contextlib import contextmanager
-from typing import Callable, Iterable
-
-from str2bool import str2bool
+import queue
+import time
+from collections import deque
+from typing import (Any, Callable, Generator, Iterable, List, NamedTuple,
+                    Optional, Sized, Tuple, Union)
 
 from reljicd_utils.collections.iter_counter import iter_counter
 from reljicd_utils.collections.iter_tools import chunks
 from reljicd_utils.logger.logger import get_logger
+from reljicd_utils.multiprocessing.accounting import (TaskAccounting,
+                                                      TaskStats, peak_rss,
+                                                      rss, task_stats)
+from reljicd_utils.multiprocessing.chunking import AUTO, AdaptiveChunker
+from reljicd_utils.multiprocessing.executors import (ASYNCIO, PROCESS, SPAWN,
+                                                     executor, spawn_scope)
 
 LOGGER = get_logger(__name__)
-SPAWN: bool = str2bool(os.getenv(key='SPAWN', default='False'))
-
-
-@contextmanager
-def spawn_scope(spawn: bool = None):
-    if spawn is None:
-        spawn = SPAWN
-
-    if spawn:
-        multiprocessing.set_start_method('spawn', force=True)
-
-    yield
-
-    if spawn:
-        if sys.platform != "win32":
-            multiprocessing.set_start_method('fork', force=True)
 
 
 def multiprocess(func: Callable,
                  iterable: Iterable,
                  num_of_processes: int,
                  chunks_size: int = 1,
-                 map_chunk_size: int = 50,
+                 map_chunk_size: Union[int, str] = 50,
                  spawn: bool = None,
                  print_progress: bool = False,
-                 print_step: int = 10000) -> None:
+                 print_step: int = 10000,
+                 backend: str = PROCESS,
+                 initializer: Callable = None,
+                 initargs: Tuple = (),
+                 maxtasksperchild: int = None,
+                 max_rss_mb: float = None,
+                 report_top: int = None) -> None:
+    """``map_chunk_size='auto'`` tunes the batch size during the run (see
+    ``AdaptiveChunker``) and ``backend`` picks a thread or asyncio pool
+    instead of processes (see ``pmap``); ``chunks_size`` is then ignored.
+    ``initializer(*initargs)`` runs once per worker before any task.
+
+    Workers are replaced after ``maxtasksperchild`` tasks, or the pool is
+    recycled when a worker grows past ``max_rss_mb``. With ``report_top``
+    per item wall time, CPU time and peak RSS growth are logged for the
+    heaviest items at the end of the run.
+    """
+    if (map_chunk_size == AUTO or backend != PROCESS or max_rss_mb or
+            report_top):
+        accounting = TaskAccounting(top=report_top) if report_top else None
+        for _ in pmap(func, iterable, workers=num_of_processes,
+                      ordered=False, chunk_size=map_chunk_size, spawn=spawn,
+                      print_progress=print_progress, print_step=print_step,
+                      backend=backend, initializer=initializer,
+                      initargs=initargs, maxtasksperchild=maxtasksperchild,
+                      max_rss_mb=max_rss_mb, accounting=accounting):
+            pass
+        if accounting:
+            accounting.log_report()
+        return
+
     if print_progress:
         iterable = iter_counter(iterable=iterable,
                                 print_step=print_step,
                                 print_message='Processing element')
 
     if num_of_processes == 1:
+        if initializer is not None:
+            initializer(*initargs)
         for args in iterable:
             func(args)
     else:
         with spawn_scope(spawn=spawn):
-            with multiprocessing.Pool(processes=num_of_processes) as p:
+            with multiprocessing.Pool(processes=num_of_processes,
+                                      initializer=initializer,
+                                      initargs=initargs,
+                                      maxtasksperchild=maxtasksperchild) as p:
                 for iter_chunk in chunks(iterable, chunks_size):
                     for _ in p.imap_unordered(func,
                                               iter_chunk,
                                               chunksize=map_chunk_size):
                         pass
+
+
+def pmap(func: Callable,
+         iterable: Iterable,
+         workers: int = os.cpu_count(),
+         ordered: bool = True,
+         chunk_size: Union[int, str] = 1,
+         max_in_flight: int = None,
+         reduce: Callable[[Any, Any], Any] = None,
+         total: int = None,
+         spawn: bool = None,
+         print_progress: bool = False,
+         print_step: int = 10000,
+         backend: str = PROCESS,
+         initializer: Callable = None,
+         initargs: Tuple = (),
+         maxtasksperchild: int = None,
+         max_rss_mb: float = None,
+         accounting: TaskAccounting = None) -> Generator[Any, None, None]:
+    """ Like ``map``, but ``func`` runs in a pool of ``workers``, reading
+    ``iterable`` only as fast as results are consumed. The first exception
+    raised by ``func`` is re-raised here. """
+    chunker = None
+    if chunk_size == AUTO:
+        if total is None and isinstance(iterable, Sized):
+            total = len(iterable)
+        chunker = AdaptiveChunker(workers=workers, total=total)
+
+    if print_progress:
+        iterable = iter_counter(iterable=iterable,
+                                print_step=print_step,
+                                print_message='Processing element')
+
+    batches = _batches(iterable,
+                       chunker.next_size if chunker else lambda: chunk_size)
+    run = functools.partial(
+        _run_chunk_async if backend == ASYNCIO else _run_chunk, func, reduce,
+        accounting is not None)
+    monitor = _Monitor(chunker, accounting,
+                       max_rss_mb * 2 ** 20
+                       if max_rss_mb and backend == PROCESS else None)
+
+    if workers == 1 and backend != ASYNCIO:
+        if initializer is not None:
+            initializer(*initargs)
+        for batch in batches:
+            callback = monitor.callback(batch)
+            chunk = run(batch)
+            callback(chunk)
+            yield from chunk.results
+        return
+
+    pool = _RecyclingExecutor(functools.partial(
+        executor, backend=backend, workers=workers, spawn=spawn,
+        initializer=initializer, initargs=initargs,
+        maxtasksperchild=maxtasksperchild))
+    max_in_flight = max_in_flight or 2 * workers
+    with pool:
+        if ordered:
+            yield from _ordered_results(pool, run, batches, max_in_flight,
+                                        monitor)
+        else:
+            yield from _unordered_results(pool, run, batches, max_in_flight,
+                                          monitor)
+
+
+class _ChunkResult(NamedTuple):
+    results: List
+    compute_seconds: float
+    stats: Optional[List[TaskStats]]
+    # Resident memory of the worker after the chunk
+    rss_bytes: Optional[int]
+
+
+class _Monitor(object):
+    """ Parent side bookkeeping of finished chunks """
+
+    def __init__(self,
+                 chunker: Optional[AdaptiveChunker],
+                 accounting: Optional[TaskAccounting],
+                 max_rss_bytes: Optional[float]):
+        self.chunker = chunker
+        self.accounting = accounting
+        self.max_rss_bytes = max_rss_bytes
+        self.over_limit = False
+
+    def callback(self,
+                 batch: List,
+                 then: Callable = None) -> Callable[[_ChunkResult], None]:
+        start = time.perf_counter()
+
+        def callback(chunk: _ChunkResult) -> None:
+            if self.chunker:
+                self.chunker.record(len(batch), chunk.compute_seconds,
+                                    time.perf_counter() - start)
+            if self.accounting and chunk.stats:
+                self.accounting.record(chunk.stats)
+            if (self.max_rss_bytes and chunk.rss_bytes and
+                    chunk.rss_bytes > self.max_rss_bytes):
+                self.over_limit = True
+            if then:
+                then(chunk)
+
+        return callback
+
+
+class _RecyclingExecutor(object):
+    """ Executor that can be swapped for a fresh one between batches """
+
+    def __init__(self, open_executor: Callable):
+        self._open_executor = open_executor
+        self._scope = None
+        self.pool = None
+
+    def __enter__(self) -> '_RecyclingExecutor':
+        self._scope = self._open_executor()
+        self.pool = self._scope.__enter__()
+        return self
+
+    def __exit__(self, *exc_info) -> Optional[bool]:
+        return self._scope.__exit__(*exc_info)
+
+    def recycle(self) -> None:
+        LOGGER.info('Worker memory over the limit, recycling the pool')
+        self.pool.close()
+        self.pool.join()
+        self._scope.__exit__(None, None, None)
+        self.__enter__()
+
+    def apply_async(self, *args, **kwargs):
+        return self.pool.apply_async(*args, **kwargs)
+
+
+def _batches(iterable: Iterable,
+             next_size: Callable[[], int]) -> Generator[List, None, None]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, next_size()))
+        if not batch:
+            return
+        yield batch
+
+
+def _run_chunk(func: Callable,
+               reduce: Optional[Callable[[Any, Any], Any]],
+               account: bool,
+               batch: List) -> _ChunkResult:
+    start = time.perf_counter()
+    results = []
+    stats = [] if account else None
+    for item in batch:
+        if account:
+            counters = time.perf_counter(), time.thread_time(), peak_rss()
+            results.append(func(item))
+            stats.append(task_stats(item, *counters))
+        else:
+            results.append(func(item))
+    if reduce is not None:
+        results = [functools.reduce(reduce, results)]
+    return _ChunkResult(results, time.perf_counter() - start, stats, rss())
+
+
+async def _run_chunk_async(func: Callable,
+                           reduce: Optional[Callable[[Any, Any], Any]],
+                           account: bool,
+                           batch: List) -> _ChunkResult:
+    start = time.perf_counter()
+    results = []
+    stats = [] if account else None
+    for item in batch:
+        # CPU time is that of the event loop thread, so it includes other
+        # coroutines running while this one awaits
+        counters = time.perf_counter(), time.thread_time(), peak_rss()
+        result = func(item)
+        if inspect.isawaitable(result):
+            result = await result
+        results.append(result)
+        if account:
+            stats.append(task_stats(item, *counters))
+    if reduce is not None:
+        results = [functools.reduce(reduce, results)]
+    return _ChunkResult(results, time.perf_counter() - start, stats, rss())
+
+
+def _ordered_results(pool: _RecyclingExecutor,
+                     run: Callable,
+                     batches: Iterable[List],
+                     max_in_flight: int,
+                     monitor: _Monitor) -> Generator[Any, None, None]:
+    in_flight = deque()
+    for batch in batches:
+        if monitor.over_limit:
+            while in_flight:
+                yield from in_flight.popleft().get().results
+            pool.recycle()
+            monitor.over_limit = False
+        if len(in_flight) >= max_in_flight:
+            yield from in_flight.popleft().get().results
+        in_flight.append(pool.apply_async(
+            run, (batch,), callback=monitor.callback(batch)))
+
+    while in_flight:
+        yield from in_flight.popleft().get().results
+
+
+def _unordered_results(pool: _RecyclingExecutor,
+                       run: Callable,
+                       batches: Iterable[List],
+                       max_in_flight: int,
+                       monitor: _Monitor) -> Generator[Any, None, None]:
+    done = queue.SimpleQueue()
+    in_flight = 0
+
+    def next_results() -> List:
+        succeeded, value = done.get()
+        if not succeeded:
+            raise value
+        return value.results
+
+    for batch in batches:
+        if monitor.over_limit:
+            while in_flight:
+                in_flight -= 1
+                yield from next_results()
+            pool.recycle()
+            monitor.over_limit = False
+        if in_flight >= max_in_flight:
+            in_flight -= 1
+            yield from next_results()
+        pool.apply_async(
+            run, (batch,),
+            callback=monitor.callback(
+                batch, then=lambda chunk: done.put((True, chunk))),
+            error_callback=lambda error: done.put((False, error)))
+        in_flight += 1
+
+    while in_flight:
+        in_flight -= 1
+        yield from next_results()
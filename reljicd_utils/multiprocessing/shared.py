@@ -0,0 +1,143 @@
+import sys
+import threading
+import weakref
+from collections import Counter
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Generator, NamedTuple, Tuple, Union
+
+import numpy
+
+_ATTACHED: Dict[str, SharedMemory] = {}
+# Live arrays per attached segment. NumPy does not hold a buffer export on
+# the mapping, so SharedMemory.close() would unmap it under them
+_ARRAYS: Counter = Counter()
+# Detached segments waiting for their arrays or memoryviews to go away
+_DETACHED: Dict[str, SharedMemory] = {}
+# Reentrant, as array finalizers can run on garbage collection under it
+_LOCK = threading.RLock()
+
+
+class SharedArray(NamedTuple):
+    """ Picklable handle of a NumPy array in shared memory """
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+    def attach(self) -> numpy.ndarray:
+        array = numpy.ndarray(self.shape, dtype=self.dtype,
+                              buffer=_attach(self.name).buf)
+        array.flags.writeable = False
+        _track(self.name, array)
+        return array
+
+
+class SharedBytes(NamedTuple):
+    """ Picklable handle of a byte buffer in shared memory """
+    name: str
+    size: int
+
+    def attach(self) -> memoryview:
+        return _attach(self.name).buf[:self.size].toreadonly()
+
+
+SharedHandle = Union[SharedArray, SharedBytes]
+
+
+@contextmanager
+def broadcast(**values: Union[numpy.ndarray, bytes, bytearray, memoryview]
+              ) -> Generator[Dict[str, SharedHandle], None, None]:
+    """Copy read-only data into shared memory once for all workers.
+
+    Yields a handle per keyword. Handles are cheap to pickle, so they can
+    go in ``initargs`` or task arguments; ``handle.attach()`` in a worker
+    maps the data without copying it. Segments are unlinked when the block
+    exits, also on errors, so create the pool inside it::
+
+        with broadcast(ids=ids) as shared:
+            pmap(func, items, initializer=init, initargs=(shared['ids'],))
+    """
+    segments = []
+    try:
+        handles = {}
+        for key, value in values.items():
+            if isinstance(value, numpy.ndarray):
+                segment = SharedMemory(create=True, size=max(value.nbytes, 1))
+                segments.append(segment)
+                numpy.ndarray(value.shape, dtype=value.dtype,
+                              buffer=segment.buf)[...] = value
+                handles[key] = SharedArray(segment.name, value.shape,
+                                           value.dtype.str)
+            elif isinstance(value, (bytes, bytearray, memoryview)):
+                data = memoryview(value).cast('B')
+                segment = SharedMemory(create=True, size=max(len(data), 1))
+                segments.append(segment)
+                segment.buf[:len(data)] = data
+                handles[key] = SharedBytes(segment.name, len(data))
+            else:
+                raise TypeError(f'Cannot broadcast {key} of type '
+                                f'{type(value).__name__}, expected a NumPy '
+                                f'array or bytes')
+        yield handles
+    finally:
+        for segment in segments:
+            _detach(segment.name)
+            segment.close()
+            segment.unlink()
+
+
+def _attach(name: str) -> SharedMemory:
+    # One mapping per process, kept open while views of it may be alive
+    with _LOCK:
+        segment = _ATTACHED.get(name)
+        if segment is None:
+            segment = _open_segment(name)
+            _ATTACHED[name] = segment
+        return segment
+
+
+def _open_segment(name: str) -> SharedMemory:
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    # Pool workers share the parent's resource tracker, where the segment
+    # is already registered, so attaching does not hand it a second owner
+    return SharedMemory(name=name)
+
+
+def _track(name: str, array: numpy.ndarray) -> None:
+    # Slices and other views keep ``array`` alive as their base
+    with _LOCK:
+        _ARRAYS[name] += 1
+    # Left to process exit, which unmaps everything anyway
+    weakref.finalize(array, _release, name).atexit = False
+
+
+def _release(name: str) -> None:
+    with _LOCK:
+        _ARRAYS[name] -= 1
+        if _ARRAYS[name] > 0:
+            return
+        del _ARRAYS[name]
+    _close_detached()
+
+
+def _detach(name: str) -> None:
+    with _LOCK:
+        segment = _ATTACHED.pop(name, None)
+        if segment is not None:
+            _DETACHED[name] = segment
+    _close_detached()
+
+
+def _close_detached() -> None:
+    with _LOCK:
+        for name in list(_DETACHED):
+            if _ARRAYS[name]:
+                continue
+            try:
+                _DETACHED[name].close()
+            except BufferError:
+                # SharedBytes memoryviews still export the mapping, retried
+                # on the next detach or release
+                continue
+            _DETACHED.pop(name, None)
@@ -1,3 +1,4 @@
 from reljicd_utils.profiling.display_top import *
 from reljicd_utils.profiling.memory import *
+from reljicd_utils.profiling.sql_report import *
 from reljicd_utils.profiling.time import *
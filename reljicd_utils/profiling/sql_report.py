@@ -0,0 +1,36 @@
+from typing import List
+
+from reljicd_utils.rdbms.instrumentation import StatementStats, sql_stats
+
+
+def sql_report(limit: int = 10, key: str = 'total_ms') -> str:
+    """ Summary of the instrumented statement shapes, heaviest first """
+    top_stats: List[StatementStats] = sorted(
+        sql_stats(), key=lambda stats: getattr(stats, key), reverse=True)
+
+    lines = [f'Top {limit} statements by {key}']
+    for index, stats in enumerate(top_stats[:limit], 1):
+        lines.append(f'#{index}: {stats.count} calls, '
+                     f'total {stats.total_ms:.1f} ms, '
+                     f'mean {stats.mean_ms:.1f} ms, '
+                     f'p50 {stats.percentile_ms(50):.1f} ms, '
+                     f'p95 {stats.percentile_ms(95):.1f} ms, '
+                     f'p99 {stats.percentile_ms(99):.1f} ms, '
+                     f'max {stats.max_ms:.1f} ms, '
+                     f'{stats.rows} rows'
+                     + (f', N+1 x{stats.n_plus_one}'
+                        if stats.n_plus_one else ''))
+        lines.append(f'    {stats.shape[:500]}')
+
+    other = top_stats[limit:]
+    if other:
+        lines.append(f'{len(other)} other: '
+                     f'{sum(stats.count for stats in other)} calls, '
+                     f'{sum(stats.total_ms for stats in other):.1f} ms')
+    lines.append(f'Total: {sum(stats.count for stats in top_stats)} calls, '
+                 f'{sum(stats.total_ms for stats in top_stats):.1f} ms')
+    return '\n'.join(lines)
+
+
+def display_sql_report(limit: int = 10, key: str = 'total_ms') -> None:
+    print(sql_report(limit=limit, key=key))
@@ -1,5 +1,11 @@
+from reljicd_utils.rdbms.async_base_model import *
+from reljicd_utils.rdbms.async_scoped_session import *
+from reljicd_utils.rdbms.async_transaction import *
 from reljicd_utils.rdbms.base_model import *
 from reljicd_utils.rdbms.execute_sql_file import *
+from reljicd_utils.rdbms.instrumentation import *
+from reljicd_utils.rdbms.lookup_cache import *
+from reljicd_utils.rdbms.maintenance import *
 from reljicd_utils.rdbms.recreate_database import *
 from reljicd_utils.rdbms.recreate_schema import *
 from reljicd_utils.rdbms.reindex_rds_indexes import *
@@ -9,3 +15,10 @@ from reljicd_utils.rdbms.set_sequences import *
 from reljicd_utils.rdbms.transaction import *
 from reljicd_utils.rdbms.utils import *
 from reljicd_utils.rdbms.vacuum_rds_schemas import *
+
+
+def __getattr__(name: str):
+    # The default engine is resolved lazily by scoped_session
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
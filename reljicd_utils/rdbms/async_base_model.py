@@ -0,0 +1,100 @@
+from typing import Any, AsyncGenerator, List, Optional, TypeVar
+
+from sqlalchemy import func, select
+from sqlalchemy.sql import Select
+
+from reljicd_utils.logger.logger import get_logger
+from reljicd_utils.rdbms.async_scoped_session import async_session_scope
+
+LOGGER = get_logger(__name__)
+
+T = TypeVar('T', bound='AsyncBaseModel')
+
+
+class AsyncBaseModel(object):
+    """ Awaitable counterparts of the BaseModel query helpers for models
+    with an ``id`` column, queried through ``async_session_scope`` """
+
+    @classmethod
+    def select(cls, *criterion: Any, **kwargs) -> Select:
+        return select(cls).filter(*criterion).filter_by(**kwargs)
+
+    @classmethod
+    async def one(cls, *criterion: Any, **kwargs) -> T:
+        async with async_session_scope() as session:
+            result = await session.execute(cls.select(*criterion, **kwargs))
+            return result.scalar_one()
+
+    @classmethod
+    async def first(cls, *criterion: Any, **kwargs) -> Optional[T]:
+        async with async_session_scope() as session:
+            result = await session.execute(
+                cls.select(*criterion, **kwargs).limit(1))
+            return result.scalars().first()
+
+    @classmethod
+    async def one_or_none(cls, *criterion: Any, **kwargs) -> Optional[T]:
+        async with async_session_scope() as session:
+            result = await session.execute(cls.select(*criterion, **kwargs))
+            return result.scalar_one_or_none()
+
+    @classmethod
+    async def count(cls, *criterion: Any, **kwargs) -> int:
+        async with async_session_scope() as session:
+            result = await session.execute(select(func.count(cls.id))
+                                           .select_from(cls)
+                                           .filter(*criterion)
+                                           .filter_by(**kwargs))
+            return result.scalar()
+
+    @classmethod
+    async def all(cls,
+                  *criterion: Any,
+                  batch_size: int = 1000,
+                  id_offset: int = 0,
+                  limit: int = None,
+                  print_progress: bool = False,
+                  columns: List[str] = None,
+                  **kwargs) -> AsyncGenerator[T, None]:
+        """Keyset paginated scan over ``id``, same as ``BaseModel.all``."""
+        if limit and batch_size > limit:
+            batch_size = limit
+        if print_progress:
+            total = await cls.count(*criterion, **kwargs)
+
+        counter = 0
+        while True:
+            if limit and counter >= limit:
+                break
+
+            # A session per page, so no connection is held between them
+            async with async_session_scope() as session:
+                result = await session.execute(
+                    cls._select(columns)
+                    .filter(*criterion)
+                    .filter_by(**kwargs)
+                    .filter(cls.id > id_offset)
+                    .order_by(cls.id)
+                    .limit(batch_size))
+                objs = result.all() if columns else result.scalars().all()
+
+            for obj in objs:
+                yield obj
+                id_offset = obj.id
+                counter += 1
+                if limit and counter >= limit:
+                    break
+
+            if print_progress:
+                LOGGER.info(f'Working on {cls.__name__} {counter}/{total}')
+
+            if len(objs) < batch_size:
+                break
+
+    @classmethod
+    def _select(cls, columns: List[str] = None) -> Select:
+        if not columns:
+            return select(cls)
+        if 'id' not in columns:
+            columns = ['id', *columns]
+        return select(*(getattr(cls, column) for column in columns))
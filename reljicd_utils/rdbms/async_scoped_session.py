@@ -0,0 +1,71 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Optional
+
+from sqlalchemy.ext.asyncio import (AsyncEngine,
+                                    AsyncSession as AlchemyAsyncSession,
+                                    async_scoped_session, create_async_engine)
+
+from reljicd_utils.rdbms.env_vars import (LOGGING_LEVEL, POSTGRES_DB,
+                                          POSTGRES_HOST,
+                                          POSTGRES_MAX_OVERFLOW,
+                                          POSTGRES_PASSWORD,
+                                          POSTGRES_POOL_PRE_PING,
+                                          POSTGRES_POOL_RECYCLE,
+                                          POSTGRES_POOL_SIZE, POSTGRES_PORT,
+                                          POSTGRES_USER)
+
+_async_engine: Optional[AsyncEngine] = None
+
+
+def get_async_engine() -> AsyncEngine:
+    # Created on first use, so asyncpg is only needed by async callers
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_engine(
+            f'postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@'
+            f'{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}',
+            echo=True if LOGGING_LEVEL == 'debug' else False,
+            pool_size=POSTGRES_POOL_SIZE,
+            max_overflow=POSTGRES_MAX_OVERFLOW,
+            pool_pre_ping=POSTGRES_POOL_PRE_PING,
+            pool_recycle=POSTGRES_POOL_RECYCLE)
+    return _async_engine
+
+
+def async_session_factory(**kwargs) -> AlchemyAsyncSession:
+    return AlchemyAsyncSession(bind=get_async_engine(),
+                               autoflush=False,
+                               expire_on_commit=False,
+                               **kwargs)
+
+
+# One session per asyncio task, so gathered transactions run concurrently.
+# Only async_transaction creates one and it always removes it; the query
+# helpers go through async_session_scope
+AsyncSession: AlchemyAsyncSession = async_scoped_session(
+    async_session_factory, scopefunc=asyncio.current_task)
+
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncGenerator[AlchemyAsyncSession, None]:
+    """ The task's session inside ``async_transaction``, otherwise a short
+    lived one that is closed on exit """
+    if AsyncSession.registry.has():
+        yield AsyncSession()
+    else:
+        async with async_session_factory() as session:
+            yield session
+
+
+def _reset_after_fork() -> None:
+    # registry.clear() looks up the current task, and a fresh child has no
+    # running loop, so every task's session is dropped at once
+    AsyncSession.registry.registry.clear()
+    if _async_engine is not None:
+        _async_engine.sync_engine.dispose(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
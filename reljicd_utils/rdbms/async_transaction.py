@@ -0,0 +1,21 @@
+import functools
+
+from reljicd_utils.rdbms.async_scoped_session import AsyncSession
+
+
+def async_transaction(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        # Created up front, so the query helpers join the transaction
+        AsyncSession()
+        try:
+            result = await func(*args, **kwargs)
+            await AsyncSession.commit()
+        except Exception:
+            await AsyncSession.rollback()
+            raise
+        finally:
+            await AsyncSession.remove()
+        return result
+
+    return wrapper
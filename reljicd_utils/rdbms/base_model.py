@@ -1,22 +1,40 @@
-from datetime import datetime
-from functools import lru_cache
-from typing import Any, Dict, Generator, List, Optional, Tuple, TypeVar
+import functools
+import io
+import itertools
+import math
+import multiprocessing
+import os
+import time
+from typing import (Any, Callable, Dict, Generator, Iterable, List,
+                    Optional, Tuple, Type, TypeVar, Union)
 
-import numpy
 import pandas
-from pandas import notnull
-from sqlalchemy import BigInteger, Column, TIMESTAMP, func
+from sqlalchemy import (BigInteger, Column, TIMESTAMP, func, tablesample,
+                        tuple_)
+from sqlalchemy.dialects.postgresql import array, insert
 from sqlalchemy.orm import Query
 from sqlalchemy.orm.exc import NoResultFound
 
+from reljicd_utils.documents.record_schema import RecordSchema
 from reljicd_utils.logger.logger import get_logger
-from reljicd_utils.rdbms.scoped_session import Session
+from reljicd_utils.multiprocessing.multiprocess import spawn_scope
+from reljicd_utils.rdbms.lookup_cache import cache_key, lookup_cache
+from reljicd_utils.rdbms.scoped_session import Session, get_engine
 from reljicd_utils.rdbms.transaction import transaction
+from reljicd_utils.utils.date_time import parse_many
 
 LOGGER = get_logger(__name__)
 
 T = TypeVar('T', bound='BaseModel')
 
+# Share of table pages read to place id shard boundaries, used once the
+# sample holds at least SAMPLE_MIN_ROWS rows
+SAMPLE_PERCENT = 1.0
+SAMPLE_MIN_ROWS = 10000
+
+# Row number of the CSV file in the copy_from_csv staging table
+STAGING_ORDER_COLUMN = 'staging_row'
+
 
 class Identifiers(object):
     def __init__(self, **kwargs):
@@ -25,6 +43,9 @@ class Identifiers(object):
 
 
 class BaseModel(object):
+    cache_maxsize: int = 1000
+    cache_ttl: Optional[float] = None
+
     id = Column(BigInteger, primary_key=True, autoincrement=True)
 
     created_at = Column(TIMESTAMP,
@@ -55,9 +76,43 @@ class BaseModel(object):
         return cls.query(*criterion, **kwargs).first()
 
     @classmethod
-    @lru_cache(maxsize=100)
     def cached_id(cls, *criterion: Any, **kwargs) -> int:
-        return cls.query(*criterion, **kwargs).one().id
+        if criterion:
+            # SQL expressions are not reliably hashable, so are not cached
+            return cls.query(*criterion, **kwargs).one().id
+
+        cache = lookup_cache(cls)
+        key = cache_key(**kwargs)
+        obj_id = cache.get(key)
+        if obj_id is None:
+            obj_id = cls._select(['id']).filter_by(**kwargs).one().id
+            cache.set(key, obj_id, session=Session())
+        return obj_id
+
+    @classmethod
+    def preload(cls, column: str,
+                values: Iterable[Any],
+                batch_size: int = None) -> int:
+        """Fill the ``cached_id`` cache for ``column`` with one IN query.
+
+        Returns the number of ids loaded.
+        """
+        cache = lookup_cache(cls)
+        attribute = getattr(cls, column)
+
+        session = Session()
+        counter = 0
+        for batch in cls._batches(set(values), batch_size):
+            for value, obj_id in (session.query(attribute, cls.id)
+                                  .filter(attribute.in_(batch))):
+                cache.set(cache_key(**{column: value}), obj_id,
+                          session=session)
+                counter += 1
+        return counter
+
+    @classmethod
+    def cache_stats(cls) -> Dict[str, Optional[float]]:
+        return lookup_cache(cls).stats()
 
     @classmethod
     def one_or_none(cls, *criterion: Any, **kwargs) -> Optional[T]:
@@ -79,7 +134,15 @@ class BaseModel(object):
             limit: int = None,
             print_progress: bool = False,
             order_by_updated_at: bool = False,
+            columns: List[str] = None,
             **kwargs) -> Generator[T, None, None]:
+        """Keyset paginated scan over ``id``.
+
+        A page shorter than ``batch_size`` ends the scan, so no COUNT is
+        issued per page. With ``columns`` rows are yielded as plain tuples
+        instead of hydrated ORM objects (``id`` is always selected, since
+        it drives the pagination).
+        """
         if limit and batch_size > limit:
             batch_size = limit
         if print_progress:
@@ -92,13 +155,14 @@ class BaseModel(object):
             if limit and counter >= limit:
                 break
 
-            objs = (cls.query(*criterion, **kwargs)
+            objs = (cls._select(columns)
+                    .filter(*criterion)
+                    .filter_by(**kwargs)
                     .filter(cls.id > id_offset)
                     .order_by(*order_by)
-                    .limit(batch_size))
+                    .limit(batch_size)
+                    .all())
 
-            if objs.count() == 0:
-                break
             for obj in objs:
                 yield obj
                 id_offset = obj.id
@@ -109,52 +173,193 @@ class BaseModel(object):
             if print_progress:
                 LOGGER.info(f'Working on {cls.__name__} {counter}/{total}')
 
+            if len(objs) < batch_size:
+                break
+
+    @classmethod
+    def stream(cls,
+               *criterion: Any,
+               yield_per: int = 1000,
+               columns: List[str] = None,
+               **kwargs) -> Generator[T, None, None]:
+        """Single query scan over a server side (named) cursor.
+
+        Rows are fetched ``yield_per`` at a time over one connection, which
+        stays checked out until the generator is exhausted or closed.
+        """
+        query = (cls._select(columns)
+                 .filter(*criterion)
+                 .filter_by(**kwargs)
+                 .order_by(cls.id)
+                 .execution_options(stream_results=True)
+                 .yield_per(yield_per))
+        for obj in query:
+            yield obj
+
+    @classmethod
+    def _select(cls, columns: List[str] = None) -> Query:
+        if not columns:
+            return Session.query(cls)
+        if 'id' not in columns:
+            columns = ['id', *columns]
+        return Session.query(*(getattr(cls, column) for column in columns))
+
     @classmethod
     def all_between_ids(cls,
                         id_lower: int,
-                        id_upper: int) -> Generator[T, None, None]:
-        count = cls.count(cls.id > id_lower, cls.id < id_upper + 1)
-        if not count:
-            return
-        for obj in cls.all(id_offset=id_lower,
-                           limit=count):
+                        id_upper: int,
+                        batch_size: int = 1000,
+                        columns: List[str] = None) -> Generator[T, None, None]:
+        for obj in cls.all(cls.id <= id_upper,
+                           id_offset=id_lower,
+                           batch_size=batch_size,
+                           columns=columns):
             yield obj
 
+    @classmethod
+    def parallel_map(cls,
+                     func: Callable[[T], Any],
+                     workers: int = os.cpu_count(),
+                     num_of_shards: int = None,
+                     sample_percent: float = SAMPLE_PERCENT,
+                     batch_size: int = 1000,
+                     columns: List[str] = None,
+                     collect_results: bool = True,
+                     spawn: bool = None) -> Generator[Any, None, None]:
+        """Apply ``func`` to every row, sharded by id across ``workers``.
+
+        Shards come from ``id_shards`` and are split into equal width id
+        ranges of about ``batch_size`` rows each. Every range runs in its own
+        transaction inside a pool worker, so results come back and are
+        yielded range by range rather than a whole shard at a time. Yields
+        ``func`` results, or the number of rows processed per range if
+        ``collect_results`` is False.
+        """
+        shards, rows = cls._id_shards(num_of_shards or workers * 4,
+                                      sample_percent=sample_percent)
+        ranges = []
+        if shards:
+            # Shards hold roughly equal row counts, so rows are taken to be
+            # spread evenly within one
+            splits = max(1, math.ceil(rows / len(shards) / batch_size))
+            for id_lower, id_upper in shards:
+                step = max(1, math.ceil((id_upper - id_lower) / splits))
+                ranges.extend((lower, min(lower + step, id_upper))
+                              for lower in range(id_lower, id_upper, step))
+
+        # Workers get a fresh engine and session through the fork hook of
+        # the engine registry
+        task = functools.partial(_process_shard, cls, func, batch_size,
+                                 columns, collect_results)
+
+        with spawn_scope(spawn=spawn):
+            with multiprocessing.Pool(processes=workers) as p:
+                for result in p.imap_unordered(task, ranges):
+                    if collect_results:
+                        yield from result
+                    else:
+                        yield result
+
     @classmethod
     def delete(cls, *criterion: Any, **kwargs) -> None:
         cls.query(*criterion, **kwargs).delete()
+        lookup_cache(cls).clear()
 
     @classmethod
     @transaction
     def insert_from_csv(cls, csv: str,
                         na_values: List[str] = None,
-                        keep_default_na=True) -> None:
+                        keep_default_na=True,
+                        schema: RecordSchema = None) -> None:
         df = pandas.read_csv(csv,
                              na_values=na_values,
                              keep_default_na=keep_default_na)
-        df = df.where((notnull(df)),
-                      None)  # Fix for converting NaN in dataframe to None
 
-        for original_record in df.to_dict('records'):
-            record = {}
-            for key, value in original_record.items():
-                # Fix for psycopg
-                if isinstance(value, numpy.int64):
-                    value = int(value)
-
-                # Fix for psycopg (ms-academic)
-                if "date" in key and value:
-                    try:
-                        value = datetime.strptime(value, '%d/%m/%Y')
-                    except ValueError:
-                        pass
-
-                record[key] = value
+        # Default schema: int fix for psycopg, "date" columns parsed with
+        # '%d/%m/%Y' (ms-academic), NaN to None
+        if schema is None:
+            schema = RecordSchema.infer(df)
 
+        for record in schema.apply(df).to_dict('records'):
             # noinspection PyArgumentList
             obj = cls(**record)
             Session.add(obj)
 
+    @classmethod
+    def copy_from_csv(cls, csv: str,
+                      na_values: List[str] = None,
+                      keep_default_na=True,
+                      chunk_size: int = 100000,
+                      date_format: str = '%d/%m/%Y',
+                      conflict_columns: List[str] = None,
+                      update_on_conflict: bool = True) -> int:
+        """Stream ``csv`` into the table with ``COPY ... FROM STDIN``.
+
+        The file is read ``chunk_size`` rows at a time, with the same NaN to
+        NULL and ``date`` column handling as ``insert_from_csv``. With
+        ``conflict_columns`` every chunk is copied into a temporary staging
+        table and merged with ``INSERT ... ON CONFLICT``, where the last of
+        the rows sharing a key within a chunk wins. Returns the number of
+        rows copied.
+        """
+        table = cls.__table__.fullname
+        target = f'{cls.__table__.name}_staging' if conflict_columns else table
+
+        counter = 0
+        started = time.perf_counter()
+        connection = get_engine().raw_connection()
+        try:
+            cursor = connection.cursor()
+            for chunk in pandas.read_csv(csv,
+                                         na_values=na_values,
+                                         keep_default_na=keep_default_na,
+                                         chunksize=chunk_size):
+                chunk = _copy_ready(chunk, date_format=date_format)
+                columns = list(chunk.columns)
+
+                if conflict_columns and not counter:
+                    # Only the CSV columns, so no defaults (e.g. nextval of
+                    # the id) are evaluated for staged rows, plus the row
+                    # order of the file for the merge
+                    cursor.execute(f'CREATE TEMPORARY TABLE {target} '
+                                   f'ON COMMIT DROP AS '
+                                   f'SELECT {", ".join(columns)} '
+                                   f'FROM {table} WITH NO DATA')
+                    cursor.execute(f'ALTER TABLE {target} ADD COLUMN '
+                                   f'{STAGING_ORDER_COLUMN} bigint '
+                                   f'GENERATED ALWAYS AS IDENTITY')
+
+                buffer = io.StringIO()
+                chunk.to_csv(buffer, index=False, header=False, na_rep=r'\N')
+                buffer.seek(0)
+                cursor.copy_expert(f'COPY {target} ({", ".join(columns)}) '
+                                   f"FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                                   buffer)
+
+                if conflict_columns:
+                    cursor.execute(_merge_statement(
+                        table=table,
+                        staging=target,
+                        columns=columns,
+                        conflict_columns=conflict_columns,
+                        update=update_on_conflict,
+                        touch_updated_at=hasattr(cls, 'updated_at')))
+                    cursor.execute(f'TRUNCATE {target}')
+
+                counter += len(chunk)
+                elapsed = time.perf_counter() - started
+                LOGGER.info(f'Copied {counter} rows into {table} '
+                            f'({counter / elapsed:.0f} rows/sec)')
+
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+        return counter
+
     @classmethod
     def get_or_create(cls, identifiers: Identifiers, **kwargs) -> T:
         try:
@@ -167,6 +372,7 @@ class BaseModel(object):
         # noinspection PyArgumentList
         obj = cls(**kwargs)
         Session.add(obj)
+        lookup_cache(cls).invalidate(**kwargs)
         return obj
 
     @classmethod
@@ -204,7 +410,214 @@ class BaseModel(object):
         return _id_tuples
 
     @classmethod
-    def bulk_insert(cls, mappings: List[Dict],
-                    return_defaults: bool = False) -> Optional[T]:
-        return Session.bulk_insert_mappings(cls, mappings,
-                                            return_defaults=return_defaults)
+    def estimated_count(cls, sample_percent: float = SAMPLE_PERCENT) -> int:
+        """ Row count scaled up from a TABLESAMPLE SYSTEM sample. Exact if
+        ``sample_percent`` is not set or the sample is too small to go by,
+        which only happens on tables that are cheap to count. """
+        if sample_percent:
+            sampled, _ = cls._sample_stats(sample_percent)
+            if sampled >= SAMPLE_MIN_ROWS:
+                return int(sampled * 100 / sample_percent)
+        return cls.count()
+
+    @classmethod
+    def id_quantiles(cls,
+                     num_of_shards: int,
+                     sample_percent: float = SAMPLE_PERCENT) -> List[int]:
+        if num_of_shards < 2:
+            return []
+        return cls._id_quantiles(num_of_shards, sample_percent)[0]
+
+    @classmethod
+    def _id_quantiles(cls,
+                      num_of_shards: int,
+                      sample_percent: float) -> Tuple[List[int], int]:
+        """ Quantiles and the (estimated) row count, from one scan """
+        fractions = [i / num_of_shards for i in range(1, num_of_shards)]
+        if sample_percent:
+            sampled, quantiles = cls._sample_stats(sample_percent, fractions)
+            if sampled >= SAMPLE_MIN_ROWS:
+                return quantiles or [], int(sampled * 100 / sample_percent)
+
+        columns = [func.count(cls.id)]
+        if fractions:
+            columns.append(func.percentile_disc(array(fractions))
+                           .within_group(cls.id))
+        row = Session.query(*columns).one()
+        return (row[1] or [] if fractions else []), row[0]
+
+    @classmethod
+    def _sample_stats(cls,
+                      sample_percent: float,
+                      fractions: List[float] = None
+                      ) -> Tuple[int, Optional[List[int]]]:
+        sample = tablesample(cls.__table__, func.system(sample_percent))
+        columns = [func.count(sample.c.id)]
+        if fractions:
+            columns.append(func.percentile_disc(array(fractions))
+                           .within_group(sample.c.id))
+        row = Session.query(*columns).select_from(sample).one()
+        return row[0], row[1] if fractions else None
+
+    @classmethod
+    def id_shards(cls,
+                  num_of_shards: int,
+                  sample_percent: float = SAMPLE_PERCENT
+                  ) -> List[Tuple[int, int]]:
+        """(id_lower, id_upper] windows holding roughly equal row counts.
+
+        Boundaries are quantiles of the id distribution over a TABLESAMPLE
+        SYSTEM sample of ``sample_percent`` of the table (the whole table if
+        it is None), so sparse id spaces do not turn into empty windows the
+        way fixed width ``id_ranges`` do.
+        """
+        return cls._id_shards(num_of_shards, sample_percent)[0]
+
+    @classmethod
+    def _id_shards(cls,
+                   num_of_shards: int,
+                   sample_percent: float
+                   ) -> Tuple[List[Tuple[int, int]], int]:
+        id_min = cls.min(column='id')
+        if id_min is None:
+            return [], 0
+        id_max = cls.max(column='id')
+
+        quantiles, rows = cls._id_quantiles(num_of_shards, sample_percent)
+        boundaries = sorted({quantile for quantile in quantiles
+                             if id_min <= quantile < id_max})
+        return (list(zip([id_min - 1, *boundaries], [*boundaries, id_max])),
+                rows)
+
+    @classmethod
+    def bulk_insert(cls, mappings: Iterable[Dict],
+                    return_defaults: bool = False,
+                    batch_size: int = None) -> None:
+        for batch in cls._batches(mappings, batch_size):
+            Session.bulk_insert_mappings(cls, batch,
+                                         return_defaults=return_defaults)
+
+    @classmethod
+    def bulk_upsert(cls, mappings: Iterable[Dict],
+                    conflict_columns: List[str],
+                    update_columns: List[str] = None,
+                    batch_size: int = 1000) -> Dict[Tuple, int]:
+        """Multi row ``INSERT ... ON CONFLICT ... RETURNING id`` per batch.
+
+        Mappings in a batch must share the same keys. Returns ids of both
+        inserted and already existing rows, keyed by the tuple of their
+        ``conflict_columns`` values. Without ``update_columns`` existing rows
+        are left untouched and their ids are read with one ``SELECT`` per
+        batch.
+        """
+        ids = {}
+        key_columns = [getattr(cls, column) for column in conflict_columns]
+        for batch in cls._batches(mappings, batch_size):
+            # A single statement must not affect the same row twice
+            unique = {tuple(mapping[column] for column in conflict_columns):
+                          mapping
+                      for mapping in batch}
+
+            statement = insert(cls).values(list(unique.values()))
+            set_ = {column: statement.excluded[column]
+                    for column in update_columns or []}
+            if set_ and hasattr(cls, 'updated_at'):
+                set_['updated_at'] = func.now()
+            if set_:
+                statement = statement.on_conflict_do_update(
+                    index_elements=conflict_columns, set_=set_)
+            else:
+                # DO NOTHING writes no row versions for existing rows, but
+                # RETURNING skips them, so they are looked up below
+                statement = statement.on_conflict_do_nothing(
+                    index_elements=conflict_columns)
+
+            for row in Session.execute(statement.returning(cls.id,
+                                                           *key_columns)):
+                ids[tuple(row[1:])] = row[0]
+
+            missing = [key for key in unique if key not in ids]
+            if missing:
+                query = (Session.query(cls.id, *key_columns)
+                         .filter(tuple_(*key_columns).in_(missing)))
+                for row in query:
+                    ids[tuple(row[1:])] = row[0]
+
+        return ids
+
+    @staticmethod
+    def _batches(items: Iterable[Any],
+                 batch_size: int = None) -> Generator[List, None, None]:
+        if not batch_size:
+            yield list(items)
+            return
+        iterator = iter(items)
+        while True:
+            batch = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                return
+            yield batch
+
+
+def _copy_ready(df: pandas.DataFrame, date_format: str) -> pandas.DataFrame:
+    for column in df.columns:
+        # Same as the per value strptime in insert_from_csv (ms-academic)
+        if 'date' in column:
+            parsed = pandas.Series(parse_many(df[column],
+                                              formats=[date_format]),
+                                   index=df.index, dtype=object)
+            df[column] = parsed.where(parsed.notnull(), df[column])
+
+        # Integer columns holding NaN are read as floats, COPY rejects "1.0"
+        elif df[column].dtype.kind == 'f':
+            values = df[column].dropna()
+            if (values % 1 == 0).all():
+                df[column] = df[column].astype('Int64')
+
+    return df
+
+
+def _merge_statement(table: str,
+                     staging: str,
+                     columns: List[str],
+                     conflict_columns: List[str],
+                     update: bool,
+                     touch_updated_at: bool) -> str:
+    column_list = ', '.join(columns)
+    conflict_list = ', '.join(conflict_columns)
+    update_columns = [column for column in columns
+                      if column not in conflict_columns]
+
+    if update and update_columns:
+        assignments = [f'{column} = EXCLUDED.{column}'
+                       for column in update_columns]
+        if touch_updated_at and 'updated_at' not in columns:
+            assignments.append('updated_at = now()')
+        action = f'DO UPDATE SET {", ".join(assignments)}'
+    else:
+        action = 'DO NOTHING'
+
+    return (f'INSERT INTO {table} ({column_list}) '
+            f'SELECT DISTINCT ON ({conflict_list}) {column_list} '
+            f'FROM {staging} '
+            f'ORDER BY {conflict_list}, {STAGING_ORDER_COLUMN} DESC '
+            f'ON CONFLICT ({conflict_list}) {action}')
+
+
+@transaction
+def _process_shard(model: Type[BaseModel],
+                   func: Callable[[BaseModel], Any],
+                   batch_size: int,
+                   columns: Optional[List[str]],
+                   collect_results: bool,
+                   shard: Tuple[int, int]) -> Union[List, int]:
+    objs = model.all_between_ids(*shard, batch_size=batch_size,
+                                 columns=columns)
+    if collect_results:
+        return [func(obj) for obj in objs]
+
+    counter = 0
+    for obj in objs:
+        func(obj)
+        counter += 1
+    return counter
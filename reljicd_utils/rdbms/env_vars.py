@@ -8,6 +8,22 @@ POSTGRES_DB: str = os.getenv(key='POSTGRES_DB', default='al_data')
 POSTGRES_USER: str = os.getenv(key='POSTGRES_USER', default='postgres')
 POSTGRES_PASSWORD: str = os.getenv(key='POSTGRES_PASSWORD', default='postgres')
 
+POSTGRES_POOL_SIZE: int = int(os.getenv(key='POSTGRES_POOL_SIZE', default='20'))
+POSTGRES_MAX_OVERFLOW: int = int(os.getenv(key='POSTGRES_MAX_OVERFLOW',
+                                           default='10'))
+POSTGRES_POOL_PRE_PING: bool = str2bool(os.getenv(key='POSTGRES_POOL_PRE_PING',
+                                                  default='False'))
+POSTGRES_POOL_RECYCLE: int = int(os.getenv(key='POSTGRES_POOL_RECYCLE',
+                                           default='-1'))
+POSTGRES_NULL_POOL: bool = str2bool(os.getenv(key='POSTGRES_NULL_POOL',
+                                              default='False'))
+
+SQL_INSTRUMENTATION: bool = str2bool(os.getenv(key='SQL_INSTRUMENTATION',
+                                               default='False'))
+SLOW_QUERY_MS: float = float(os.getenv(key='SLOW_QUERY_MS', default='1000'))
+N_PLUS_ONE_THRESHOLD: int = int(os.getenv(key='N_PLUS_ONE_THRESHOLD',
+                                          default='20'))
+
 LOGGING_LEVEL: str = os.getenv(key='LOGGING_LEVEL', default='info')
 
 DEBUG: bool = str2bool(os.getenv(key='DEBUG', default='False'))
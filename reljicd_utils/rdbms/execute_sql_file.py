@@ -1,12 +1,12 @@
 import fire
 from sqlalchemy import text
 
-from reljicd_utils.rdbms.scoped_session import engine
+from reljicd_utils.rdbms.scoped_session import get_engine
 
 
 def execute_sql_file(file: str) -> None:
     with open(file) as f:
-        engine.execute(text(f.read())).execution_options(autocommit=True)
+        get_engine().execute(text(f.read())).execution_options(autocommit=True)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,177 @@
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from reljicd_utils.logger.logger import get_logger
+from reljicd_utils.rdbms.env_vars import (N_PLUS_ONE_THRESHOLD,
+                                          SLOW_QUERY_MS)
+
+LOGGER = get_logger(__name__)
+
+# Upper bounds (ms) of the latency histogram buckets
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500,
+                   1000, 2000, 5000, 10000, math.inf)
+
+_PLACEHOLDER_RE = re.compile(r'%\([^)]*\)s|%s|\$\d+|:\w+|\?')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_VALUES_RE = re.compile(r'(\([^()]*\))(?:\s*,\s*\([^()]*\))+')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def statement_shape(statement: str) -> str:
+    """ Statement with literals, placeholders and value lists collapsed """
+    shape = _PLACEHOLDER_RE.sub('?', statement)
+    shape = _STRING_RE.sub('?', shape)
+    shape = _NUMBER_RE.sub('?', shape)
+    shape = _IN_LIST_RE.sub('(...)', shape)
+    shape = _VALUES_RE.sub(r'\1, ...', shape)
+    return _WHITESPACE_RE.sub(' ', shape).strip()
+
+
+class StatementStats(object):
+    def __init__(self, shape: str):
+        self.shape = shape
+        self.count = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.n_plus_one = 0
+        self.errors = 0
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+
+    def record(self, ms: float, rows: int, error: bool = False) -> None:
+        self.count += 1
+        self.errors += error
+        self.rows += rows
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        for i, upper_bound in enumerate(LATENCY_BUCKETS):
+            if ms <= upper_bound:
+                self.histogram[i] += 1
+                break
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+    def percentile_ms(self, percentile: float) -> float:
+        """ Upper bound of the bucket holding the given percentile """
+        threshold = self.count * percentile / 100
+        cumulative = 0
+        for upper_bound, bucket_count in zip(LATENCY_BUCKETS, self.histogram):
+            cumulative += bucket_count
+            if bucket_count and cumulative >= threshold:
+                return min(upper_bound, self.max_ms)
+        return self.max_ms
+
+
+class QueryInstrumentation(object):
+    """ Per statement shape latency and row counts from cursor events.
+
+    Statements slower than ``slow_query_ms`` are logged with their
+    parameters, as are failed ones (e.g. cancelled by statement_timeout),
+    and shapes executed ``n_plus_one_threshold`` times or more inside one
+    transaction are flagged as possible N+1 patterns. """
+
+    def __init__(self,
+                 slow_query_ms: float = SLOW_QUERY_MS,
+                 n_plus_one_threshold: int = N_PLUS_ONE_THRESHOLD):
+        self.slow_query_ms = slow_query_ms
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.stats: Dict[str, StatementStats] = {}
+        self._lock = threading.Lock()
+
+    def attach(self, engine: Engine) -> None:
+        if event.contains(engine, 'after_cursor_execute', self._after):
+            return
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+        event.listen(engine, 'handle_error', self._error)
+        event.listen(engine, 'commit', self._end_transaction)
+        event.listen(engine, 'rollback', self._end_transaction)
+        event.listen(engine, 'checkin', self._checkin)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stats = {}
+
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany) -> None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany) -> None:
+        ms = (time.perf_counter() - conn.info['query_started'].pop()) * 1000
+        rows = max(cursor.rowcount, 0)
+        self._record(conn, statement, ms, rows)
+
+        if ms >= self.slow_query_ms:
+            LOGGER.warning(f'Slow query ({ms:.0f} ms, {rows} rows): '
+                           f'{statement} {repr(parameters)[:1000]}')
+
+    def _error(self, context) -> None:
+        conn = context.connection
+        started = conn.info.get('query_started') if conn is not None else None
+        # Errors raised before the cursor executed have no start time
+        if not started or context.statement is None:
+            return
+
+        ms = (time.perf_counter() - started.pop()) * 1000
+        self._record(conn, context.statement, ms, 0, error=True)
+        LOGGER.warning(f'Failed query ({ms:.0f} ms): {context.statement} '
+                       f'{repr(context.parameters)[:1000]}: '
+                       f'{context.original_exception}')
+
+    def _record(self, conn, statement: str, ms: float, rows: int,
+                error: bool = False) -> None:
+        shape = statement_shape(statement)
+        with self._lock:
+            stats = self.stats.get(shape)
+            if stats is None:
+                stats = self.stats[shape] = StatementStats(shape)
+            stats.record(ms, rows, error=error)
+
+        conn.info.setdefault('statement_shapes', Counter())[shape] += 1
+
+    def _end_transaction(self, conn) -> None:
+        shapes = conn.info.pop('statement_shapes', None)
+        if not shapes:
+            return
+
+        for shape, count in shapes.items():
+            if count >= self.n_plus_one_threshold:
+                LOGGER.warning(f'Possible N+1: {count} executions in one '
+                               f'transaction of: {shape}')
+                with self._lock:
+                    # Gone if the stats were reset during the transaction
+                    stats = self.stats.get(shape)
+                    if stats is not None:
+                        stats.n_plus_one += 1
+
+    def _checkin(self, dbapi_connection, connection_record) -> None:
+        connection_record.info.pop('statement_shapes', None)
+        connection_record.info.pop('query_started', None)
+
+
+INSTRUMENTATION = QueryInstrumentation()
+
+
+def instrument_engine(engine: Engine) -> None:
+    INSTRUMENTATION.attach(engine)
+
+
+def sql_stats() -> List[StatementStats]:
+    with INSTRUMENTATION._lock:
+        return list(INSTRUMENTATION.stats.values())
+
+
+def reset_sql_stats() -> None:
+    INSTRUMENTATION.reset()
@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from sqlalchemy import event
+
+from reljicd_utils.rdbms.scoped_session import session_factory
+
+Key = Tuple[Tuple[str, Any], ...]
+
+
+class LookupCache(object):
+    """ Bounded LRU cache with optional TTL and hit/miss counters """
+
+    def __init__(self, maxsize: int = 1000, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        # Column names of the cached keys, with the number of keys having
+        # them, so invalidate() looks up keys instead of scanning entries
+        self._columns: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, session: Any = None) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._columns[_columns(key)] += 1
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+        if session is not None and (entry is None or entry[0] != value):
+            # Kept only if the session's transaction commits
+            session.info.setdefault(_SESSION_KEYS, []).append((self, key))
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate(self, **values) -> None:
+        """ Drop entries whose key columns all match ``values`` """
+        with self._lock:
+            stale = [tuple((column, values[column]) for column in columns)
+                     for columns in self._columns
+                     if all(column in values for column in columns)]
+            for key in stale:
+                if key in self._entries:
+                    self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._columns.clear()
+
+    def _remove(self, key: Hashable) -> None:
+        del self._entries[key]
+        columns = _columns(key)
+        self._columns[columns] -= 1
+        if not self._columns[columns]:
+            del self._columns[columns]
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hit_rate': self.hits / lookups if lookups else None}
+
+
+_CACHES: Dict[type, LookupCache] = {}
+
+# Session.info entry with the (cache, key) pairs set in its transaction
+_SESSION_KEYS = 'lookup_cache_keys'
+
+
+def cache_key(**values) -> Key:
+    return tuple(sorted(values.items()))
+
+
+def _columns(key: Hashable) -> Tuple:
+    # Keys other than cache_key() ones are never invalidated by columns
+    if isinstance(key, tuple) and all(isinstance(item, tuple) and
+                                      len(item) == 2 for item in key):
+        return tuple(column for column, _ in key)
+    return ()
+
+
+def lookup_cache(model: type) -> LookupCache:
+    cache = _CACHES.get(model)
+    if cache is None:
+        cache = _CACHES.setdefault(
+            model, LookupCache(maxsize=getattr(model, 'cache_maxsize', 1000),
+                               ttl=getattr(model, 'cache_ttl', None)))
+    return cache
+
+
+def clear_lookup_caches() -> None:
+    for cache in _CACHES.values():
+        cache.clear()
+
+
+@event.listens_for(session_factory, 'after_commit')
+def _keep_on_commit(session) -> None:
+    session.info.pop(_SESSION_KEYS, None)
+
+
+@event.listens_for(session_factory, 'after_transaction_end')
+def _discard_on_rollback(session, transaction) -> None:
+    # Ids cached in a transaction that did not commit may belong to rows
+    # that no longer exist; entries cached before it are left alone
+    if transaction.parent is None:
+        for cache, key in session.info.pop(_SESSION_KEYS, ()):
+            cache.discard(key)
+
+
+def _reset_after_fork() -> None:
+    for cache in _CACHES.values():
+        cache._lock = threading.Lock()
+        cache.clear()
+        cache.hits = cache.misses = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,131 @@
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Tuple
+
+import fire
+from sqlalchemy import text
+
+from reljicd_utils.logger.logger import get_logger
+from reljicd_utils.rdbms.scoped_session import get_engine
+from reljicd_utils.rdbms.set_sequences import SCHEMAS
+from reljicd_utils.rdbms.utils import execute_statement
+
+LOGGER = get_logger(__name__)
+
+
+class TableStats(NamedTuple):
+    # Quoted identifiers, ready to put in statements
+    schema: str
+    table: str
+    total_bytes: int
+    live_tuples: int
+    dead_tuples: int
+
+    @property
+    def dead_tuple_ratio(self) -> float:
+        tuples = self.live_tuples + self.dead_tuples
+        return self.dead_tuples / tuples if tuples else 0.0
+
+
+class TableTiming(NamedTuple):
+    schema: str
+    table: str
+    total_bytes: int
+    timings: Tuple[Tuple[str, float, bool], ...]
+
+    @property
+    def seconds(self) -> float:
+        return sum(seconds for _, seconds, _ in self.timings)
+
+
+def tables_by_size(schemas: List = SCHEMAS) -> List[TableStats]:
+    rows = get_engine().execute(text(
+        "SELECT quote_ident(n.nspname), quote_ident(c.relname), "
+        "pg_total_relation_size(c.oid), "
+        "COALESCE(s.n_live_tup, 0), COALESCE(s.n_dead_tup, 0) "
+        "FROM pg_class c "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid "
+        "WHERE c.relkind IN ('r', 'm') AND n.nspname = ANY(:schemas) "
+        "ORDER BY pg_total_relation_size(c.oid) DESC"),
+        schemas=list(schemas))
+    return [TableStats(*row) for row in rows]
+
+
+def run_maintenance(schemas: List = SCHEMAS,
+                    vacuum: bool = True,
+                    reindex: bool = True,
+                    concurrency: int = 4,
+                    dead_tuple_threshold: float = 0.0,
+                    concurrently: bool = True) -> List[TableTiming]:
+    """VACUUM ANALYSE and/or REINDEX tables, largest first.
+
+    At most ``concurrency`` tables are processed at once, each over its
+    own connection. Tables whose dead tuple ratio is below
+    ``dead_tuple_threshold`` are skipped. ``REINDEX ... CONCURRENTLY`` is
+    used on PostgreSQL 12+ unless ``concurrently`` is False.
+    """
+    started = time.perf_counter()
+
+    tables = []
+    for stats in tables_by_size(schemas):
+        if stats.dead_tuple_ratio < dead_tuple_threshold:
+            LOGGER.info(f'{stats.schema}.{stats.table} skipped '
+                        f'(dead tuples {stats.dead_tuple_ratio:.1%})')
+        else:
+            tables.append(stats)
+
+    concurrently = (concurrently and
+                    get_engine().dialect.server_version_info >= (12,))
+    maintain = functools.partial(_maintain_table,
+                                 vacuum=vacuum,
+                                 reindex=reindex,
+                                 concurrently=concurrently)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        timings = list(executor.map(maintain, tables))
+
+    _log_report(timings, seconds=time.perf_counter() - started)
+    return timings
+
+
+def _maintain_table(stats: TableStats,
+                    vacuum: bool,
+                    reindex: bool,
+                    concurrently: bool) -> TableTiming:
+    name = f'{stats.schema}.{stats.table}'
+    statements = []
+    if vacuum:
+        statements.append(f'VACUUM ANALYSE {name}')
+    if reindex:
+        statements.append(f'REINDEX TABLE CONCURRENTLY {name}'
+                          if concurrently else f'REINDEX TABLE {name}')
+
+    timings = []
+    for statement in statements:
+        LOGGER.info(f'{statement} ...')
+        started = time.perf_counter()
+        succeeded = execute_statement(statement)
+        seconds = time.perf_counter() - started
+        LOGGER.info(f'{statement} '
+                    f'{"done" if succeeded else "FAILED"} in {seconds:.1f}s')
+        timings.append((statement.split(' ')[0], seconds, succeeded))
+
+    return TableTiming(stats.schema, stats.table, stats.total_bytes,
+                       tuple(timings))
+
+
+def _log_report(timings: List[TableTiming], seconds: float) -> None:
+    LOGGER.info(f'Maintenance of {len(timings)} tables '
+                f'done in {seconds:.1f}s')
+    for timing in sorted(timings, key=lambda t: t.seconds, reverse=True):
+        operations = ', '.join(
+            f'{operation} {op_seconds:.1f}s' + ('' if succeeded else ' FAILED')
+            for operation, op_seconds, succeeded in timing.timings)
+        LOGGER.info(f'{timing.schema}.{timing.table} '
+                    f'({timing.total_bytes / 2 ** 20:.0f} MiB): '
+                    f'{timing.seconds:.1f}s [{operations}]')
+
+
+if __name__ == '__main__':
+    fire.Fire(run_maintenance)
@@ -2,10 +2,11 @@ import fire
 from sqlalchemy.exc import ProgrammingError
 from sqlalchemy_utils import create_database, drop_database
 
-from reljicd_utils.rdbms.scoped_session import engine
+from reljicd_utils.rdbms.scoped_session import get_engine
 
 
 def recreate_database(name: str = None, template: str = None) -> None:
+    engine = get_engine()
     engine.dispose()
 
     url = str(engine.url)
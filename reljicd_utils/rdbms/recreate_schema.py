@@ -4,7 +4,7 @@ import fire
 from sqlalchemy import inspect
 from sqlalchemy.sql.ddl import CreateSchema, DropSchema
 
-from reljicd_utils.rdbms.scoped_session import engine
+from reljicd_utils.rdbms.scoped_session import get_engine
 from reljicd_utils.rdbms.transaction import transaction
 
 PUBLIC_SCHEMA = 'public'
@@ -25,6 +25,7 @@ def recreate_schema(schema: str,
     if schema not in schema_bases:
         raise AttributeError
 
+    engine = get_engine()
     if schema in inspect(engine).get_schema_names():
         print(f'Dropping {schema} schema...')
         engine.execute(DropSchema(name=schema, cascade=True))
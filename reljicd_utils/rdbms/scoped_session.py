@@ -1,23 +1,145 @@
-from typing import Callable
+import os
+import threading
+from typing import Any, Callable, Dict
 
 from sqlalchemy import create_engine
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import (Session as AlchemySession, scoped_session,
                             sessionmaker)
+from sqlalchemy.pool import NullPool
 
 from reljicd_utils.rdbms.env_vars import (LOGGING_LEVEL, POSTGRES_DB,
                                           POSTGRES_HOST,
-                                          POSTGRES_PASSWORD, POSTGRES_PORT,
-                                          POSTGRES_USER)
-
-engine: Engine = create_engine(
-    f'postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@'
-    f'{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}',
-    # poolclass=NullPool,
-    echo=True if LOGGING_LEVEL == 'debug' else False,
-    pool_size=20,
-    max_overflow=10)
-session_factory: Callable[..., AlchemySession] = sessionmaker(bind=engine,
-                                                              autoflush=False)
+                                          POSTGRES_MAX_OVERFLOW,
+                                          POSTGRES_NULL_POOL,
+                                          POSTGRES_PASSWORD,
+                                          POSTGRES_POOL_PRE_PING,
+                                          POSTGRES_POOL_RECYCLE,
+                                          POSTGRES_POOL_SIZE, POSTGRES_PORT,
+                                          POSTGRES_USER,
+                                          SQL_INSTRUMENTATION)
+from reljicd_utils.rdbms.instrumentation import instrument_engine
+
+DEFAULT_ENGINE = 'default'
+DATABASE_URL: str = (f'postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@'
+                     f'{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}')
+
+
+class EngineRegistry(object):
+    """ Named engines, created on first use and reset in forked children """
+
+    def __init__(self):
+        self._options: Dict[str, Dict[str, Any]] = {}
+        self._engines: Dict[str, Engine] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, name: str = DEFAULT_ENGINE, **options) -> None:
+        with self._lock:
+            self._options[name] = options
+            engine = self._engines.pop(name, None)
+        if engine is not None:
+            engine.dispose()
+
+    def get(self, name: str = DEFAULT_ENGINE) -> Engine:
+        engine = self._engines.get(name)
+        if engine is None:
+            with self._lock:
+                engine = self._engines.get(name)
+                if engine is None:
+                    engine = _create_engine(**self._options.get(name, {}))
+                    self._engines[name] = engine
+        return engine
+
+    def dispose(self) -> None:
+        with self._lock:
+            engines = list(self._engines.values())
+            self._engines.clear()
+        for engine in engines:
+            engine.dispose()
+
+    def reset_after_fork(self) -> None:
+        # Connections belong to the parent, so drop them without closing
+        self._lock = threading.Lock()
+        for engine in self._engines.values():
+            engine.dispose(close=False)
+
+
+def _create_engine(url: str = None,
+                   pool_size: int = POSTGRES_POOL_SIZE,
+                   max_overflow: int = POSTGRES_MAX_OVERFLOW,
+                   pool_pre_ping: bool = POSTGRES_POOL_PRE_PING,
+                   pool_recycle: int = POSTGRES_POOL_RECYCLE,
+                   null_pool: bool = POSTGRES_NULL_POOL,
+                   instrument: bool = SQL_INSTRUMENTATION,
+                   **kwargs) -> Engine:
+    kwargs.setdefault('echo', True if LOGGING_LEVEL == 'debug' else False)
+    if null_pool:
+        kwargs['poolclass'] = NullPool
+    else:
+        kwargs.update(pool_size=pool_size,
+                      max_overflow=max_overflow,
+                      pool_recycle=pool_recycle)
+
+    engine = create_engine(url or DATABASE_URL,
+                           pool_pre_ping=pool_pre_ping,
+                           **kwargs)
+    if instrument:
+        instrument_engine(engine)
+    return engine
+
+
+ENGINES = EngineRegistry()
+
+
+def configure_engine(name: str = DEFAULT_ENGINE, **options) -> None:
+    """Set ``create_engine`` options for this process.
+
+    Besides the usual keyword arguments it takes ``url``, ``null_pool`` and
+    ``instrument``. An already created engine is disposed and rebuilt on
+    next use.
+    """
+    ENGINES.configure(name, **options)
+
+
+def get_engine(name: str = DEFAULT_ENGINE) -> Engine:
+    return ENGINES.get(name)
+
+
+def dispose_engines() -> None:
+    ENGINES.dispose()
+
+
+def __getattr__(name: str) -> Any:
+    # ``engine`` is the default engine, created on first use. Code that
+    # outlives configure_engine() or a fork should call get_engine() instead
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+class _LazySessionmaker(sessionmaker):
+    def __call__(self, **local_kw) -> AlchemySession:
+        local_kw.setdefault('bind', get_engine())
+        return super().__call__(**local_kw)
+
+
+session_factory: Callable[..., AlchemySession] = _LazySessionmaker(
+    autoflush=False)
 
 Session: AlchemySession = scoped_session(session_factory)
+
+# Sessions inherited from the parent, never used or collected in the child
+_INHERITED_SESSIONS = []
+
+
+def _reset_after_fork() -> None:
+    # Collecting the parent's session would check its connection back in,
+    # rolling back the parent's transaction over the shared socket
+    if Session.registry.has():
+        _INHERITED_SESSIONS.append(Session.registry())
+    Session.registry.clear()
+    ENGINES.reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
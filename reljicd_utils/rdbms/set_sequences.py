@@ -1,26 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
 import fire
 from sqlalchemy.exc import ProgrammingError
 
-from reljicd_utils.rdbms.scoped_session import engine
+from reljicd_utils.rdbms.scoped_session import get_engine
 
 SCHEMAS = ['public']
 
+# Every sequence owned by a table column (serial / identity) in a schema
+OWNED_SEQUENCES_QUERY = (
+    "SELECT quote_ident(n.nspname) || '.' || quote_ident(t.relname) AS tbl, "
+    "quote_ident(a.attname) AS col, "
+    "quote_ident(sn.nspname) || '.' || quote_ident(s.relname) AS seq "
+    "FROM pg_depend d "
+    "JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S' "
+    "JOIN pg_namespace sn ON sn.oid = s.relnamespace "
+    "JOIN pg_class t ON t.oid = d.refobjid "
+    "JOIN pg_namespace n ON n.oid = t.relnamespace "
+    "JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = d.refobjsubid "
+    "WHERE d.classid = 'pg_class'::regclass "
+    "AND d.refclassid = 'pg_class'::regclass "
+    "AND d.deptype IN ('a', 'i') "
+    "AND n.nspname = '{schema}'")
+
+
+def set_all_sequences(schemas: List = None,
+                      bulk: bool = True,
+                      num_of_workers: int = 4) -> None:
+    if schemas is None:
+        schemas = SCHEMAS
+
+    if not bulk:
+        for schema in schemas:
+            set_schema_sequences_per_table(schema)
+        return
+
+    with ThreadPoolExecutor(max_workers=num_of_workers) as executor:
+        for schema in executor.map(set_schema_sequences, schemas):
+            print(f'[Schema: {schema}] sequences set')
+
+
+def set_schema_sequences(schema: str) -> str:
+    """Resync every owned sequence of ``schema`` in one DO block.
+
+    The catalog lookup and the per table setval run server side, so the
+    whole schema costs a single round trip. Tables without an owned
+    sequence are simply not part of the catalog query.
+    """
+    query = OWNED_SEQUENCES_QUERY.format(schema=schema.replace("'", "''"))
+    with get_engine().begin() as connection:
+        # No parameters, so the DBAPI leaves the %L / %s of format() alone
+        connection.execution_options(no_parameters=True).exec_driver_sql(
+            f"DO $$\n"
+            f"DECLARE r record;\n"
+            f"BEGIN\n"
+            f"  FOR r IN {query} LOOP\n"
+            f"    EXECUTE format("
+            f"'SELECT pg_catalog.setval(%L, COALESCE(MAX(%s), 1), "
+            f"MAX(%s) IS NOT NULL) FROM %s', r.seq, r.col, r.col, r.tbl);\n"
+            f"  END LOOP;\n"
+            f"END $$;")
+    return schema
+
 
-def set_all_sequences() -> None:
-    for schema in SCHEMAS:
-        tables = [row[0] for row in engine.execute(
-            f"SELECT table_name FROM information_schema.tables "
-            f"WHERE table_schema = '{schema}'")]
+def set_schema_sequences_per_table(schema: str) -> None:
+    tables = [row[0] for row in get_engine().execute(
+        f"SELECT table_name FROM information_schema.tables "
+        f"WHERE table_schema = '{schema}'")]
 
-        for table in tables:
-            try:
-                set_sequence(schema, table)
-            except ProgrammingError:
-                print(f'[Table: {table}] skipped')
+    for table in tables:
+        try:
+            set_sequence(schema, table)
+        except ProgrammingError:
+            print(f'[Table: {table}] skipped')
 
 
 def set_sequence(schema: str, table: str) -> None:
-    engine.execute(
+    get_engine().execute(
         f"SELECT pg_catalog.setval(pg_get_serial_sequence("
         f"'{schema}.{table}', 'id'), "
         f"MAX(id)) FROM {schema}.{table}")
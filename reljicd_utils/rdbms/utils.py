@@ -1,26 +1,29 @@
 from typing import List
 
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.exc import DBAPIError
 
 from reljicd_utils.logger.logger import get_logger
-from reljicd_utils.rdbms.scoped_session import engine
+from reljicd_utils.rdbms.scoped_session import get_engine
 
 LOGGER = get_logger(__name__)
 
 
 def schema_tables(schema: str) -> List[str]:
-    return [row[0] for row in engine.execute(
+    return [row[0] for row in get_engine().execute(
         f"SELECT table_name FROM information_schema.tables "
         f"WHERE table_schema = '{schema}'")]
 
 
-def execute_statement(statement: str) -> None:
+def execute_statement(statement: str) -> bool:
+    # AUTOCOMMIT is reset when the connection goes back to the pool
     try:
-        connection = engine.raw_connection()
-        connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        cursor = connection.cursor()
-        cursor.execute(statement)
-        cursor.close()
-    except ProgrammingError:
-        LOGGER.error(f'Failed execution of: "{statement}"')
+        autocommit_engine = get_engine().execution_options(
+            isolation_level='AUTOCOMMIT')
+        with autocommit_engine.connect() as connection:
+            connection.exec_driver_sql(statement)
+        return True
+    except DBAPIError as e:
+        # Also lost connections, lock timeouts and statements the server
+        # does not support, so one failure does not stop a batch of them
+        LOGGER.error(f'Failed execution of: "{statement}": {e.orig}')
+        return False
@@ -1,20 +1,95 @@
 from datetime import datetime
-from typing import Optional
+from functools import lru_cache
+from typing import Iterable, List, Optional, Sequence, Tuple
 
+import pandas
 
+ISO_DATETIME_UTC_FORMAT = '%Y-%m-%dT%H:%M:%S+00:00'
+ISO_DATE_FORMAT = '%Y-%m-%d'
+DATETIME_FORMATS = (ISO_DATETIME_UTC_FORMAT, ISO_DATE_FORMAT)
+
+# Dates in ingested data repeat a lot, so parsed values are memoized
+CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=CACHE_SIZE)
 def str_to_timestamp(timestamp: str) -> datetime:
     return datetime.strptime(timestamp, '%d %B %Y')
 
 
 def year_to_timestamp(year: int) -> datetime:
-    return datetime.strptime(str(year), '%Y')
+    return datetime(int(year), 1, 1)
 
 
+@lru_cache(maxsize=CACHE_SIZE)
 def str_to_datetime(datetime_str: str) -> Optional[datetime]:
     if datetime_str:
+        parsed = _parse_iso(datetime_str)
+        if parsed is not None:
+            return parsed
         try:
-            return datetime.strptime(datetime_str, '%Y-%m-%dT%H:%M:%S+00:00')
+            return datetime.strptime(datetime_str, ISO_DATETIME_UTC_FORMAT)
         except ValueError:
-            return datetime.strptime(datetime_str, '%Y-%m-%d')
+            return datetime.strptime(datetime_str, ISO_DATE_FORMAT)
     else:
         return None
+
+
+def parse_many(strings: Iterable[Optional[str]],
+               formats: Sequence[str] = DATETIME_FORMATS
+               ) -> List[Optional[datetime]]:
+    """Parse a whole column at once; values that match none of ``formats``
+    (or are missing) come back as None."""
+    values = pandas.Series(list(strings), dtype=object)
+    parsed = pandas.Series(pandas.NaT, index=values.index,
+                           dtype='datetime64[ns]')
+
+    pending = values.notnull()
+    for date_format in formats:
+        if not pending.any():
+            break
+        parsed[pending] = pandas.to_datetime(values[pending],
+                                             format=date_format,
+                                             errors='coerce')
+        pending &= parsed.isnull()
+
+    results = [None if pandas.isnull(value) else value
+               for value in parsed.dt.to_pydatetime()]
+    # Dates outside the datetime64[ns] range (1677-2262, e.g. 9999-12-31
+    # sentinels) are coerced to NaT, so those are parsed one by one
+    formats = tuple(formats)
+    for i in pending.to_numpy().nonzero()[0]:
+        results[i] = _strptime(values.iat[i], formats)
+    return results
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _strptime(value: str, formats: Tuple[str, ...]) -> Optional[datetime]:
+    for date_format in formats:
+        try:
+            return datetime.strptime(value, date_format)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def _parse_iso(value: str) -> Optional[datetime]:
+    """ strptime free fast path for the fixed ISO layouts """
+    length = len(value)
+    if length == 10:
+        layout_matches = value[4] == '-' and value[7] == '-'
+    elif length == 25:
+        layout_matches = (value[4] == '-' and value[7] == '-' and
+                          value[10] == 'T' and value[13] == ':' and
+                          value[16] == ':' and value.endswith('+00:00'))
+        value = value[:19]
+    else:
+        return None
+
+    if not layout_matches or not value.replace('-', '').replace(
+            'T', '').replace(':', '').isdigit():
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
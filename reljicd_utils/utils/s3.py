@@ -1,7 +1,11 @@
+import io
 import os
+import shutil
+import tempfile
 from collections import namedtuple
+from contextlib import contextmanager
 from operator import attrgetter
-from typing import Generator, Tuple
+from typing import BinaryIO, Generator, Tuple, Union
 from urllib.parse import urlparse
 
 import boto3
@@ -29,6 +33,73 @@ def read_file(s3_path: str) -> str:
     return obj.get()['Body'].read().decode('utf-8')
 
 
+class S3Reader(io.RawIOBase):
+    """ Raw stream over the body of an S3 object """
+
+    def __init__(self, body):
+        self._body = body
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._body.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            self._body.close()
+        super().close()
+
+
+def open_file(s3_path: str,
+              buffer_size: int = 2 ** 20) -> io.BufferedReader:
+    s3_bucket, s3_key = parse_s3_path(s3_path)
+    resource = boto3.resource('s3')
+    obj = resource.Object(s3_bucket, s3_key)
+    return io.BufferedReader(S3Reader(obj.get()['Body']),
+                             buffer_size=buffer_size)
+
+
+def is_s3_path(path: str) -> bool:
+    return path.startswith('s3://')
+
+
+@contextmanager
+def open_path(path: str, seekable: bool = False) -> Generator[BinaryIO,
+                                                               None, None]:
+    """Binary file object for a local or ``s3://`` path.
+
+    S3 objects are streamed, or spooled to a temporary file in chunks when
+    the reader needs to seek (e.g. xlsx archives).
+    """
+    if not is_s3_path(path):
+        with open(path, 'rb') as f:
+            yield f
+    elif seekable:
+        with open_file(path) as body, tempfile.TemporaryFile() as f:
+            shutil.copyfileobj(body, f, length=2 ** 20)
+            f.seek(0)
+            yield f
+    else:
+        with open_file(path) as f:
+            yield f
+
+
+@contextmanager
+def open_source(path: str,
+                seekable: bool = False) -> Generator[Union[str, BinaryIO],
+                                                     None, None]:
+    """ Local paths as they are, so readers keep handling them themselves
+    (e.g. decompressing by extension), ``s3://`` paths as ``open_path`` """
+    if is_s3_path(path):
+        with open_path(path, seekable=seekable) as f:
+            yield f
+    else:
+        yield path
+
+
 def read_files(s3_path: str) -> Generator[str, None, None]:
     for filename in get_filenames(s3_path, full_names=True):
         yield read_file(filename)
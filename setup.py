@@ -37,9 +37,12 @@ DEPENDENCIES = [
     'SQLAlchemy',
     'sqlalchemy-utils',
     'psycopg2-binary',
+    'asyncpg',
     'boto3',
     'xmltodict',
     'pandas',
+    'openpyxl',
+    'pyarrow',
     'str2bool',
     'numpy'
 ]